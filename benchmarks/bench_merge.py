@@ -0,0 +1,53 @@
+# Compares the old per-page merge loop with the single-pass merge engine.
+# Usage: python benchmarks/bench_merge.py [pages ...]
+import io
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+from reportlab.lib.utils import ImageReader
+from pdf_engine import PageStore
+
+def make_sample_pdf(n_pages):
+    img = Image.effect_noise((400, 400), 64).convert("RGB"); img_buf = io.BytesIO(); img.save(img_buf, format="PNG"); img_buf.seek(0)
+    logo = ImageReader(img_buf); buf = io.BytesIO(); c = canvas.Canvas(buf, pagesize=(612, 792))
+    for i in range(n_pages):
+        c.setFont("Times-Roman", 11)
+        for j in range(40): c.drawString(60, 740 - j * 16, f"Page {i + 1}, line {j + 1}: the quick brown fox jumps over the lazy dog")
+        c.drawImage(logo, 400, 40, 120, 120); c.showPage()
+    c.save()
+    return buf.getvalue()
+
+# The intake + "Download Final Merged PDF" loop as it was before the page store.
+def old_merge(pdf_bytes):
+    queue = []
+    for i, page in enumerate(PdfReader(io.BytesIO(pdf_bytes)).pages):
+        writer = PdfWriter(); writer.add_page(page); p_bytes = io.BytesIO(); writer.write(p_bytes)
+        queue.append({'bytes': p_bytes.getvalue(), 'rotation': 90 if i % 7 == 0 else 0})
+    final_merger = PdfWriter()
+    for item in queue:
+        page = PdfReader(io.BytesIO(item['bytes'])).pages[0]
+        if item['rotation'] != 0: page.rotate(item['rotation'])
+        final_merger.add_page(page)
+    out = io.BytesIO(); final_merger.write(out)
+    return out.getvalue()
+
+def new_merge(pdf_bytes):
+    store = PageStore(); records = store.records(store.add(pdf_bytes))
+    for i, record in enumerate(records): record['rotation'] = 90 if i % 7 == 0 else 0
+    return store.write(records)
+
+def timed(func, arg):
+    start = time.perf_counter(); result = func(arg)
+    return time.perf_counter() - start, len(result)
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [50, 200, 1000]
+    print(f"{'pages':>6} | {'old (s)':>8} | {'old size':>10} | {'new (s)':>8} | {'new size':>10} | speedup")
+    for n in sizes:
+        sample = make_sample_pdf(n)
+        t_old, s_old = timed(old_merge, sample); t_new, s_new = timed(new_merge, sample)
+        print(f"{n:>6} | {t_old:>8.2f} | {s_old/1024:>8.0f}KB | {t_new:>8.2f} | {s_new/1024:>8.0f}KB | {t_old/t_new:>6.1f}x")
@@ -0,0 +1,45 @@
+# Compares the old pypdf rotate loop with the metadata-only page box edit (full save and
+# incremental update), next to a plain file copy as the lower bound.
+# Usage: python benchmarks/bench_page_boxes.py [pages ...]
+import io
+import os
+import sys
+import time
+import shutil
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import img2pdf
+import pikepdf
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+from pdf_engine import edit_page_boxes
+
+# A scan-like file: every page embeds its own full-page JPEG, so the size grows with pages.
+def make_scan_pdf(n_pages, path):
+    buf = io.BytesIO(); Image.effect_noise((1275, 1650), 48).convert("RGB").save(buf, format="JPEG", quality=60); jpeg = buf.getvalue()
+    with open(path, "wb") as f: img2pdf.convert([jpeg] * n_pages, outputstream=f)
+
+# The "Rotate All & Download" handler as it was before the fast path.
+def old_rotate(src_path, out_path):
+    reader = PdfReader(src_path); writer = PdfWriter()
+    for page in reader.pages: page.rotate(90); writer.add_page(page)
+    with open(out_path, "wb") as f: writer.write(f)
+
+def new_rotate(src_path, out_path, incremental=False):
+    with pikepdf.open(src_path) as pdf: total = len(pdf.pages)
+    edit_page_boxes(src_path, out_path, rotations={i: 90 for i in range(total)}, incremental=incremental)
+
+def timed(func, *args):
+    start = time.perf_counter(); func(*args)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [200, 1000]
+    print(f"{'pages':>6} | {'size':>8} | {'copy (s)':>8} | {'old (s)':>8} | {'save (s)':>8} | {'incr (s)':>8} | speedup")
+    with tempfile.TemporaryDirectory() as work_dir:
+        src_path, out_path = os.path.join(work_dir, "in.pdf"), os.path.join(work_dir, "out.pdf")
+        for n in sizes:
+            make_scan_pdf(n, src_path)
+            t_copy = timed(shutil.copyfile, src_path, out_path); t_old = timed(old_rotate, src_path, out_path)
+            t_save = timed(new_rotate, src_path, out_path); t_incr = timed(new_rotate, src_path, out_path, True)
+            print(f"{n:>6} | {os.path.getsize(src_path)/2**20:>6.0f}MB | {t_copy:>8.3f} | {t_old:>8.2f} | {t_save:>8.2f} | {t_incr:>8.2f} | {t_old/t_incr:>6.1f}x")
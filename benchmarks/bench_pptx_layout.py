@@ -0,0 +1,67 @@
+# Compares the old rounded-top line grouping of create_editable_pptx with the
+# tolerance-based group_lines, on speed and on how many lines come out intact.
+# Usage: python benchmarks/bench_pptx_layout.py [pages ...]
+import io
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pdfplumber
+from reportlab.pdfgen import canvas
+from pdf_engine import group_lines
+
+# Dense pages where each line mixes font sizes on one baseline, so word tops differ by a
+# point or two. Every word is tagged with its line ("L12w3") to score the grouping.
+def make_sample_pdf(n_pages, lines_per_page=60, words_per_line=12):
+    buf = io.BytesIO(); c = canvas.Canvas(buf, pagesize=(612, 792))
+    for _ in range(n_pages):
+        for j in range(lines_per_page):
+            x = 30; y = 770 - j * 12.5
+            for k in range(words_per_line):
+                size = (8, 9, 10)[(j + k) % 3]; word = f"L{j}w{k}"
+                c.setFont("Helvetica", size); c.drawString(x, y, word); x += c.stringWidth(word, "Helvetica", size) + 4
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+# The grouping loop as it was inside create_editable_pptx.
+def old_group_lines(words):
+    lines = {}
+    for w in words:
+        y = round(w['top'], 0)
+        if y not in lines: lines[y] = []
+        lines[y].append(w)
+    out = []
+    for y in sorted(lines.keys()):
+        line_words = lines[y]
+        line_text = " ".join([w['text'] for w in line_words])
+        x0 = min([w['x0'] for w in line_words])
+        top = min([w['top'] for w in line_words])
+        width = sum([w['x1'] - w['x0'] for w in line_words]) + (len(line_words) * 3)
+        height = max([w['bottom'] - w['top'] for w in line_words])
+        avg_size = sum([w['size'] for w in line_words]) / len(line_words)
+        out.append((line_text, x0, top, width, height, avg_size))
+    return out
+
+# A line counts as correct when it holds exactly the words of one source line.
+def accuracy(pages, group):
+    correct = total = 0
+    for words in pages:
+        truth = {}
+        for w in words: truth.setdefault(w['text'].split("w")[0], set()).add(w['text'])
+        found = [set(line[0].split()) for line in group(words)]
+        correct += sum(1 for s in found if s in truth.values()); total += len(truth)
+    return correct / total if total else 1.0
+
+def timed(group, pages):
+    start = time.perf_counter()
+    for words in pages: group(words)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [20, 100]
+    print(f"{'pages':>6} | {'old (s)':>8} | {'old acc':>7} | {'new (s)':>8} | {'new acc':>7} | speedup")
+    for n in sizes:
+        with pdfplumber.open(io.BytesIO(make_sample_pdf(n))) as pdf: pages = [p.extract_words(extra_attrs=["fontname", "size"]) for p in pdf.pages]
+        t_old = timed(old_group_lines, pages); t_new = timed(group_lines, pages)
+        print(f"{n:>6} | {t_old:>8.3f} | {accuracy(pages, old_group_lines):>6.0%} | {t_new:>8.3f} | {accuracy(pages, group_lines):>6.0%} | {t_old/t_new:>6.1f}x")
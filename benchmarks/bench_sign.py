@@ -0,0 +1,56 @@
+# Compares the old "Sign & Download PDF" loop (a reportlab overlay with its own copy of
+# the signature per page) with PageStore.sign, on time and on how much the file grows.
+# Usage: python benchmarks/bench_sign.py [pages ...]
+import io
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PIL import Image, ImageDraw
+from pypdf import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+from reportlab.lib.utils import ImageReader
+from bench_merge import make_sample_pdf
+from pdf_engine import PageStore
+
+PLACEMENT = (100, 100, 150, 50)
+
+def make_signature():
+    img = Image.new("RGBA", (600, 200), (0, 0, 0, 0)); draw = ImageDraw.Draw(img)
+    for k in range(0, 560, 20): draw.line((20 + k, 150 - (k % 60), 40 + k, 50 + (k % 80)), fill=(0, 0, 0, 255), width=6)
+    return img
+
+# The signing loop as it was before the page store, fed one-page PDFs like the old queue.
+def old_sign(pdf_bytes, sig):
+    queue = []
+    for page in PdfReader(io.BytesIO(pdf_bytes)).pages:
+        writer = PdfWriter(); writer.add_page(page); p_bytes = io.BytesIO(); writer.write(p_bytes); queue.append(p_bytes.getvalue())
+    x_pos, y_pos, width, height = PLACEMENT
+    writer = PdfWriter(); img_byte_arr = io.BytesIO(); sig.save(img_byte_arr, format='PNG')
+    for item in queue:
+        page = PdfReader(io.BytesIO(item)).pages[0]
+        t_writer = PdfWriter(); t_writer.add_page(page); t_io = io.BytesIO(); t_writer.write(t_io)
+        target_page = PdfReader(io.BytesIO(t_io.getvalue())).pages[0]
+        pg_w = float(target_page.mediabox.width); pg_h = float(target_page.mediabox.height)
+        packet = io.BytesIO(); c = canvas.Canvas(packet, pagesize=(pg_w, pg_h))
+        img_byte_arr.seek(0); c.drawImage(ImageReader(img_byte_arr), x_pos, y_pos, width=width, height=height, mask='auto'); c.save(); packet.seek(0)
+        target_page.merge_page(PdfReader(packet).pages[0]); writer.add_page(target_page)
+    out = io.BytesIO(); writer.write(out)
+    return out.getvalue()
+
+def new_sign(pdf_bytes, sig):
+    store = PageStore(); records = store.records(store.add(pdf_bytes))
+    return store.sign(records, sig, PLACEMENT)
+
+def timed(func, pdf_bytes, sig):
+    start = time.perf_counter(); result = func(pdf_bytes, sig)
+    return time.perf_counter() - start, len(result)
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [50, 400]
+    sig = make_signature()
+    print(f"{'pages':>6} | {'old (s)':>8} | {'old growth':>10} | {'new (s)':>8} | {'new growth':>10} | speedup")
+    for n in sizes:
+        sample = make_sample_pdf(n); store = PageStore(); base = len(store.write(store.records(store.add(sample))))
+        t_old, s_old = timed(old_sign, sample, sig); t_new, s_new = timed(new_sign, sample, sig)
+        print(f"{n:>6} | {t_old:>8.2f} | {(s_old - base)/1024:>8.0f}KB | {t_new:>8.2f} | {(s_new - base)/1024:>8.0f}KB | {t_old/t_new:>6.1f}x")
@@ -0,0 +1,36 @@
+# Measures how stamping scales with worker processes. Page numbers in a TrueType font need
+# one overlay per page, which is the case the worker pool renders in parallel; a tiled
+# watermark is drawn once and shared, so it is shown as the single-overlay baseline.
+# Usage: python benchmarks/bench_stamp.py [pages ...]
+import os
+import sys
+import time
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import reportlab
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from bench_merge import make_sample_pdf
+from pdf_engine import stamp_pdf
+
+VERA = os.path.join(os.path.dirname(reportlab.__file__), "fonts", "Vera.ttf")
+PAGE_NUMBERS = {'kind': 'text', 'text': "Page {page} of {total}", 'font': "Vera", 'size': 12, 'rgb': (0, 0, 0), 'opacity': 1.0, 'position': "Bottom Right", 'margin': 20}
+WATERMARK = {'kind': 'watermark', 'text': "CONFIDENTIAL", 'font': "Helvetica", 'size': 50, 'rgb': (0.5, 0.5, 0.5), 'opacity': 0.5, 'rotation': 45, 'tiled': True, 'gap_x': 200, 'gap_y': 200, 'position': None, 'xy': None}
+
+def timed(src_path, out_path, stamp, workers):
+    start = time.perf_counter(); stamp_pdf(src_path, out_path, stamp, max_workers=workers)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    pdfmetrics.registerFont(TTFont("Vera", VERA))
+    sizes = [int(a) for a in sys.argv[1:]] or [100, 1000, 5000]
+    cores = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, 8, cores} & set(range(1, cores + 1)))
+    print(f"{'pages':>6} | {'watermark (s)':>13} | " + " | ".join(f"{f'numbers x{w} (s)':>16}" for w in worker_counts) + " | speedup")
+    with tempfile.TemporaryDirectory() as work_dir:
+        src_path, out_path = os.path.join(work_dir, "in.pdf"), os.path.join(work_dir, "out.pdf")
+        for n in sizes:
+            with open(src_path, "wb") as f: f.write(make_sample_pdf(n))
+            t_wm = timed(src_path, out_path, WATERMARK, 1)
+            times = [timed(src_path, out_path, PAGE_NUMBERS, w) for w in worker_counts]
+            print(f"{n:>6} | {t_wm:>13.2f} | " + " | ".join(f"{t:>16.2f}" for t in times) + f" | {times[0]/times[-1]:>6.1f}x")
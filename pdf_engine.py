@@ -0,0 +1,1307 @@
+# Processing engines for VIAPDF.
+# Kept outside pdf_tool.py because Streamlit re-executes that script on every rerun:
+# objects stored in st.session_state and functions handed to worker processes must
+# live in a module that is imported once.
+import io
+import os
+import copy
+import sys
+import time
+import uuid
+import queue
+import shutil
+import subprocess
+import sqlite3
+import zipfile
+import tempfile
+import contextlib
+import functools
+import hashlib
+import json
+import math
+import zlib
+import threading
+import importlib.machinery
+import concurrent.futures
+from collections import OrderedDict, deque
+import numpy as np
+import pikepdf
+import pdfplumber
+import pandas as pd
+import img2pdf
+from PIL import Image, ImageDraw, ImageFont, features
+from pypdf import PdfReader
+from pdf2image import convert_from_bytes, convert_from_path
+from reportlab.pdfgen import canvas
+from reportlab.pdfbase import pdfmetrics
+
+# --- HELPER: PROCESS POOL ---
+# Under Streamlit, sys.modules['__main__'] is the app script (with __file__ but no
+# __spec__), so spawned workers would re-run the whole UI on start-up. Giving it a
+# "__main__" spec makes multiprocessing skip re-importing it; workers only need this module.
+def process_pool(max_workers=None):
+    main = sys.modules.get('__main__')
+    if main is not None and getattr(main, '__spec__', None) is None and hasattr(main, '__file__'):
+        main.__spec__ = importlib.machinery.ModuleSpec('__main__', None)
+    return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers or os.cpu_count() or 1)
+
+def chunked(items, n_chunks):
+    size = max(1, -(-len(items) // max(1, n_chunks)))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+# Runs func over task argument tuples: inline for one worker, otherwise on a process pool.
+# Yields (task_index, result) as tasks finish. With a window, at most that many tasks are
+# submitted ahead, which bounds the finished results waiting to be consumed.
+def run_tasks(func, tasks, max_workers=None, window=None, kill_on_stop=False):
+    workers = max_workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) <= 1:
+        for i, args in enumerate(tasks): yield i, func(*args)
+        return
+    executor = process_pool(workers); pending = {}; submitted = 0
+    try:
+        while submitted < len(tasks) or pending:
+            while submitted < len(tasks) and (window is None or len(pending) < window):
+                pending[executor.submit(func, *tasks[submitted])] = submitted; submitted += 1
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done: yield pending.pop(future), future.result()
+    finally:
+        # Reached early when the consumer stops iterating (error or Streamlit rerun):
+        # queued tasks are dropped instead of running to completion. With kill_on_stop the
+        # running ones are terminated as well and reaped before returning, for tasks that
+        # write into a directory the caller is about to remove.
+        stopped = kill_on_stop and bool(pending)
+        if stopped:
+            if hasattr(executor, 'terminate_workers'): executor.terminate_workers()
+            else:
+                for process in list((getattr(executor, '_processes', None) or {}).values()): process.terminate()
+        executor.shutdown(wait=stopped, cancel_futures=True)
+
+# Same as run_tasks, but yields results in task order, holding back only the ones that
+# finish early.
+def run_tasks_ordered(func, tasks, max_workers=None, window=None):
+    ready, next_index = {}, 0
+    for i, result in run_tasks(func, tasks, max_workers, window):
+        ready[i] = result
+        while next_index in ready:
+            yield next_index, ready.pop(next_index); next_index += 1
+
+# --- HELPER: CONCATENATE PDF FILES ---
+# qpdf reads stream data lazily from the part files, so the final save streams them
+# through without holding every page in memory. Large part lists are merged in batches
+# to stay under open-file limits.
+def concat_pdf_files(paths, out_path, batch=200):
+    if len(paths) > batch:
+        merged = []
+        for i in range(0, len(paths), batch):
+            merged.append(f"{out_path}.{i}.part"); concat_pdf_files(paths[i:i + batch], merged[-1], batch)
+        concat_pdf_files(merged, out_path, batch)
+        for path in merged: os.remove(path)
+        return out_path
+    parts = []
+    try:
+        with pikepdf.new() as out:
+            for path in paths:
+                parts.append(pikepdf.open(path)); out.pages.extend(parts[-1].pages)
+            out.save(out_path, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    finally:
+        for part in parts: part.close()
+    return out_path
+
+# --- HELPER: CONTENT HASH ---
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:16]
+
+# --- HELPER: SINGLE-PASS MERGE ---
+# Opens every source once and clones the requested pages in record order. qpdf keeps
+# one foreign-object map per source, so fonts/images shared between pages of the same
+# source are copied a single time. The output is written once, with object streams.
+# A page appended twice would come back as a copy of the one already in the output, with
+# its rotation and layers, so repeats are cloned from the untouched source page (own
+# dictionary and /Contents array). Rotation is the source's /Rotate plus the record's.
+def _source_rotation(page):
+    node = page.obj
+    while node is not None:
+        if '/Rotate' in node: return int(node.Rotate)
+        node = node.get('/Parent')
+    return 0
+
+def append_page(out, src, page_index, rotation=0, seen=None):
+    page = src.pages[page_index]; key = (id(src), page_index)
+    if seen is not None and key in seen:
+        clone = copy.copy(page.obj)
+        if isinstance(clone.get('/Contents'), pikepdf.Array): clone.Contents = pikepdf.Array(list(clone.Contents))
+        out.pages.append(pikepdf.Page(src.make_indirect(clone)))
+    else: out.pages.append(page)
+    if seen is not None: seen.add(key)
+    new_page = out.pages[-1]; angle = (_source_rotation(page) + rotation) % 360
+    if angle or '/Rotate' in new_page.obj: new_page.obj.Rotate = angle
+    return new_page
+
+# on_page(pdf, page, n): called with each assembled page (n is its queue position) so
+# layers can be added in the same pass, before the single save.
+def merge_pages(docs, records, output, on_page=None):
+    sources = {}; seen = set()
+    try:
+        with pikepdf.new() as out:
+            for record in records:
+                doc_id = record['doc_id']
+                if doc_id not in sources: sources[doc_id] = pikepdf.open(io.BytesIO(docs[doc_id]))
+                append_page(out, sources[doc_id], record['page_index'], record.get('rotation', 0), seen)
+                if on_page: on_page(out, out.pages[-1], len(out.pages) - 1)
+            out.save(output, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    finally:
+        for src in sources.values(): src.close()
+    return output
+
+# --- HELPER: SHARED PAGE STORE ---
+# Holds each source PDF once (keyed by content hash). Page queues only keep small
+# records: {'id', 'doc_id', 'page_index', 'rotation', 'source', 'page_num'}.
+class PageStore:
+    def __init__(self):
+        self.docs = {}
+        self.readers = {}
+
+    def add(self, pdf_bytes):
+        doc_id = content_hash(pdf_bytes)
+        if doc_id not in self.docs: self.docs[doc_id] = pdf_bytes
+        return doc_id
+
+    def reader(self, doc_id):
+        if doc_id not in self.readers: self.readers[doc_id] = PdfReader(io.BytesIO(self.docs[doc_id]))
+        return self.readers[doc_id]
+
+    def page_count(self, doc_id):
+        return len(self.reader(doc_id).pages)
+
+    def records(self, doc_id, source=None):
+        return [{'id': str(uuid.uuid4()), 'doc_id': doc_id, 'page_index': i, 'page_num': i + 1, 'source': source, 'rotation': 0}
+                for i in range(self.page_count(doc_id))]
+
+    # Pages are cloned into the writer before rotating so the cached reader is never mutated.
+    def add_to_writer(self, writer, record):
+        page = writer.add_page(self.reader(record['doc_id']).pages[record['page_index']])
+        if record.get('rotation', 0) != 0: page.rotate(record['rotation'])
+        return page
+
+    def write(self, records, output=None):
+        if output is not None: return merge_pages(self.docs, records, output)
+        out = io.BytesIO(); merge_pages(self.docs, records, out)
+        return out.getvalue()
+
+    def sign(self, records, image, placement, pages=None, output=None):
+        if output is not None: return sign_pages(self.docs, records, output, image, placement, pages)
+        out = io.BytesIO(); sign_pages(self.docs, records, out, image, placement, pages)
+        return out.getvalue()
+
+    def prune(self, keep_doc_ids):
+        for doc_id in list(self.docs):
+            if doc_id not in keep_doc_ids:
+                self.docs.pop(doc_id, None); self.readers.pop(doc_id, None)
+
+# --- HELPER: CONTIGUOUS PAGE RANGES ---
+def page_ranges(page_indices):
+    ranges = []
+    for i in sorted(set(page_indices)):
+        if ranges and i == ranges[-1][1] + 1: ranges[-1][1] = i
+        else: ranges.append([i, i])
+    return [tuple(r) for r in ranges]
+
+# --- HELPER: BATCHED THUMBNAIL RENDERER ---
+# One pdf2image call per contiguous page range; thread_count splits the range across
+# parallel pdftoppm processes. Returns {page_index: PIL image}.
+def render_page_range(pdf_bytes, first_index, last_index, poppler_path=None, width=200, dpi=72, thread_count=None, use_cropbox=False):
+    thread_count = max(1, min(thread_count or os.cpu_count() or 1, last_index - first_index + 1))
+    common_args = {"first_page": first_index + 1, "last_page": last_index + 1, "dpi": dpi, "size": (width, None), "thread_count": thread_count, "use_cropbox": use_cropbox}
+    if poppler_path: images = convert_from_bytes(pdf_bytes, poppler_path=poppler_path, **common_args)
+    else: images = convert_from_bytes(pdf_bytes, **common_args)
+    return dict(zip(range(first_index, last_index + 1), images))
+
+# --- HELPER: DISK LRU CACHE ---
+# Byte values stored as files named by a hash of the key. Recency is the file mtime
+# (bumped on every hit), so the LRU order survives restarts.
+class DiskLRUCache:
+    def __init__(self, root, max_bytes, suffix=".bin"):
+        os.makedirs(root, exist_ok=True)
+        self.root = root; self.max_bytes = max_bytes; self.suffix = suffix
+        self.lock = threading.Lock(); self.entries = OrderedDict()
+        files = [e for e in os.scandir(root) if e.is_file() and e.name.endswith(suffix)]
+        for entry in sorted(files, key=lambda e: e.stat().st_mtime): self.entries[entry.name] = entry.stat().st_size
+        self.total = sum(self.entries.values())
+
+    def _name(self, key):
+        return hashlib.sha256(repr(key).encode()).hexdigest() + self.suffix
+
+    def get(self, key):
+        name = self._name(key); path = os.path.join(self.root, name)
+        try:
+            with open(path, "rb") as f: data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        with self.lock:
+            if name in self.entries: self.entries.move_to_end(name)
+        return data
+
+    def put(self, key, data):
+        name = self._name(key); path = os.path.join(self.root, name); tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f: f.write(data)
+        os.replace(tmp, path)
+        with self.lock:
+            self.total += len(data) - self.entries.pop(name, 0); self.entries[name] = len(data)
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                old_name, size = self.entries.popitem(last=False); self.total -= size
+                try: os.remove(os.path.join(self.root, old_name))
+                except OSError: pass
+
+# --- HELPER: THUMBNAIL CACHE ---
+# Thumbnails keyed by (doc hash, page index, width, dpi, rotation), stored as WebP
+# (PNG when Pillow lacks WebP support) in a DiskLRUCache.
+THUMB_FORMAT = "WEBP" if features.check("webp") else "PNG"
+
+class ThumbnailRenderer:
+    def __init__(self, poppler_path=None, cache_dir=None, max_bytes=256 * 1024 * 1024):
+        self.poppler_path = poppler_path
+        self.cache = DiskLRUCache(cache_dir, max_bytes, suffix="." + THUMB_FORMAT.lower())
+        self.failed = set()
+
+    def _load(self, key):
+        data = self.cache.get(key)
+        return Image.open(io.BytesIO(data)) if data else None
+
+    def _store(self, key, img):
+        buf = io.BytesIO()
+        if THUMB_FORMAT == "WEBP": img.save(buf, format="WEBP", quality=80)
+        else: img.save(buf, format="PNG", optimize=True)
+        self.cache.put(key, buf.getvalue())
+
+    # pages: iterable of (page_index, rotation); returns {(page_index, rotation): image or None}
+    def thumbnails(self, doc_id, pdf_bytes, pages, width=200):
+        dpi = 72 if width <= 200 else 150; results = {}; missing = []
+        for page_index, rotation in set(pages):
+            if (doc_id, page_index, width, dpi, 0) in self.failed: results[(page_index, rotation)] = None; continue
+            results[(page_index, rotation)] = self._load((doc_id, page_index, width, dpi, rotation % 360))
+            if results[(page_index, rotation)] is None: missing.append((page_index, rotation))
+        bases = {}
+        for page_index in {i for i, _ in missing}:
+            bases[page_index] = self._load((doc_id, page_index, width, dpi, 0))
+        for first, last in page_ranges([i for i, img in bases.items() if img is None]):
+            try: rendered = render_page_range(pdf_bytes, first, last, self.poppler_path, width, dpi)
+            except Exception: rendered = {}
+            for i in range(first, last + 1):
+                img = rendered.get(i)
+                # Failed pages are remembered so a broken page doesn't respawn poppler on every rerun
+                if img is None: self.failed.add((doc_id, i, width, dpi, 0))
+                else: self._store((doc_id, i, width, dpi, 0), img)
+                bases[i] = img
+        for page_index, rotation in missing:
+            img = bases.get(page_index)
+            if img is not None and rotation % 360 != 0:
+                img = img.rotate(-rotation, expand=True); self._store((doc_id, page_index, width, dpi, rotation % 360), img)
+            results[(page_index, rotation)] = img
+        return results
+
+# --- HELPER: SPLIT ENGINE ---
+# groups: [(file_name, [(page_index, rotation), ...]), ...]. Each worker opens the source
+# once per batch and writes its group PDFs to out_dir; the parent adds finished files to
+# the ZIP on disk in group order as batches come in, so only file paths are held in memory.
+def _write_split_batch(src_path, batch, out_dir):
+    results = []
+    with pikepdf.open(src_path) as src:
+        for name, pages in batch:
+            with pikepdf.new() as part:
+                seen = set()
+                for page_index, rotation in pages: append_page(part, src, page_index, rotation, seen)
+                path = os.path.join(out_dir, f"{uuid.uuid4().hex}.pdf"); part.save(path)
+            results.append(path)
+    return results
+
+def split_to_zip(src_path, groups, zip_path, out_dir, max_workers=None, progress=None):
+    workers = max_workers or os.cpu_count() or 1
+    indexed = list(enumerate(groups)); batches = chunked(indexed, workers * 4); paths = {}
+    tasks = [(src_path, [g for _, g in batch], out_dir) for batch in batches]
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        for done, (b, batch_paths) in enumerate(run_tasks_ordered(_write_split_batch, tasks, workers)):
+            for (idx, (name, _)), path in zip(batches[b], batch_paths): zf.write(path, name); paths[idx] = path
+            if progress: progress((done + 1) / len(batches))
+    return [(name, paths[idx]) for idx, (name, _) in indexed]
+
+# --- HELPER: RESULT STORE ---
+# Large outputs are spilled to a per-session directory and the UI keeps a small handle
+# {'path', 'file_name', 'mime', 'size', 'created'}. Directories of sessions that have not
+# touched the store for `ttl` seconds are removed; each session is capped at `quota`
+# bytes, oldest results evicted first.
+def read_file(path):
+    with open(path, "rb") as f: return f.read()
+
+def read_zip_member(zip_path, name):
+    with zipfile.ZipFile(zip_path) as zf: return zf.read(name)
+
+def path_size(path):
+    if os.path.isfile(path): return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+class ResultStore:
+    def __init__(self, session_id, root=None, ttl=3600, quota=2 * 1024 * 1024 * 1024):
+        self.root = root or os.path.join(tempfile.gettempdir(), "viapdf_results")
+        self.dir = os.path.join(self.root, session_id); self.ttl = ttl; self.quota = quota; self.handles = []
+        os.makedirs(self.dir, exist_ok=True)
+
+    def new_path(self, suffix=""):
+        os.makedirs(self.dir, exist_ok=True)
+        return os.path.join(self.dir, uuid.uuid4().hex + suffix)
+
+    def new_dir(self):
+        path = self.new_path(); os.makedirs(path)
+        return path
+
+    def register(self, path, file_name=None, mime="application/octet-stream"):
+        handle = {'path': path, 'file_name': file_name or os.path.basename(path), 'mime': mime, 'size': path_size(path), 'created': time.time()}
+        self.handles.append(handle)
+        while sum(h['size'] for h in self.handles) > self.quota and len(self.handles) > 1: self.discard(self.handles[0])
+        self.touch(); self.sweep()
+        return handle
+
+    def put(self, data, file_name, mime="application/octet-stream"):
+        path = self.new_path(os.path.splitext(file_name)[1])
+        with open(path, "wb") as f: f.write(data)
+        return self.register(path, file_name, mime)
+
+    def exists(self, handle):
+        return handle is not None and os.path.exists(handle['path'])
+
+    def reader(self, handle):
+        return functools.partial(read_file, handle['path'])
+
+    def discard(self, handle):
+        if handle is None: return
+        if handle in self.handles: self.handles.remove(handle)
+        if os.path.isdir(handle['path']): shutil.rmtree(handle['path'], ignore_errors=True)
+        elif os.path.exists(handle['path']): os.remove(handle['path'])
+
+    # Engine inputs and outputs that never got a handle (failed or cancelled runs) are not
+    # counted by the quota, so handlers remove them here; registered results are kept.
+    def cleanup(self, *paths):
+        registered = {h['path'] for h in self.handles}
+        for path in paths:
+            if path is None or path in registered: continue
+            if os.path.isdir(path): shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path): os.remove(path)
+
+    def touch(self):
+        if os.path.isdir(self.dir): os.utime(self.dir)
+
+    def sweep(self):
+        cutoff = time.time() - self.ttl
+        for entry in os.scandir(self.root):
+            try:
+                if entry.is_dir() and entry.path != self.dir and entry.stat().st_mtime < cutoff: shutil.rmtree(entry.path, ignore_errors=True)
+            except OSError: pass
+
+# --- HELPER: STRONG COMPRESSION (FLATTEN TO IMAGES) ---
+# Each task rasterizes a small page chunk with its own pdftoppm call, JPEG-encodes it and
+# writes a chunk PDF; the chunks are then concatenated. Peak memory is bounded by
+# workers x chunk_size rasters, independent of the page count.
+def _flatten_chunk(pdf_path, first_index, last_index, dpi, quality, out_path, poppler_path=None):
+    common_args = {"dpi": dpi, "first_page": first_index + 1, "last_page": last_index + 1}
+    if poppler_path: images = convert_from_path(pdf_path, poppler_path=poppler_path, **common_args)
+    else: images = convert_from_path(pdf_path, **common_args)
+    jpegs = []
+    for img in images:
+        if img.mode != "RGB": img = img.convert("RGB")
+        b = io.BytesIO(); img.save(b, format='JPEG', quality=quality); jpegs.append(b.getvalue())
+    with open(out_path, "wb") as f: f.write(img2pdf.convert(jpegs))
+    return out_path
+
+def compress_strong(pdf_path, out_path, dpi=150, quality=60, poppler_path=None, chunk_size=4, max_workers=None, progress=None):
+    with pikepdf.open(pdf_path) as pdf: total = len(pdf.pages)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(out_path) or None) as work_dir:
+        tasks = [(pdf_path, first, min(first + chunk_size, total) - 1, dpi, quality, os.path.join(work_dir, f"chunk_{first:06d}.pdf"), poppler_path)
+                 for first in range(0, total, chunk_size)]
+        for done, _ in enumerate(run_tasks(_flatten_chunk, tasks, max_workers)):
+            if progress: progress((done + 1) / len(tasks))
+        concat_pdf_files([t[5] for t in tasks], out_path)
+    return total
+
+# --- HELPER: SELECTIVE IMAGE RECOMPRESSION ---
+# Only image XObjects are touched; content streams, fonts and vectors are copied as-is.
+# Workers reopen the file and look images up by object number, so no pixel data is pickled.
+# reportlab wraps images in an ASCII filter ([/ASCII85Decode /DCTDecode]); such leading
+# ASCII layers are peeled off through pikepdf, other filter chains are left alone.
+RECOMPRESS_FILTERS = (None, '/DCTDecode', '/FlateDecode')
+ASCII_FILTERS = ('/ASCII85Decode', '/ASCIIHexDecode')
+
+def _image_filter(obj):
+    filters = obj.get('/Filter')
+    if filters is None: return None
+    if isinstance(filters, pikepdf.Array):
+        names = [str(f) for f in filters]
+        while names and names[0] in ASCII_FILTERS: names.pop(0)
+        if len(names) > 1: return 'chain'
+        return names[0] if names else None
+    return str(filters)
+
+def _image_bytes(pdf, obj):
+    filters = obj.get('/Filter')
+    if not isinstance(filters, pikepdf.Array) or str(filters[0]) not in ASCII_FILTERS: return obj.read_raw_bytes()
+    ascii_layers = pikepdf.Array([f for f in filters if str(f) in ASCII_FILTERS])
+    return pikepdf.Stream(pdf, obj.read_raw_bytes(), Filter=ascii_layers).read_bytes(decode_level=pikepdf.StreamDecodeLevel.generalized)
+
+def _recompressible(obj):
+    if obj.get('/ImageMask', False) or '/Mask' in obj or '/Decode' in obj: return False
+    if int(obj.get('/BitsPerComponent', 8)) != 8 or _image_filter(obj) not in RECOMPRESS_FILTERS: return False
+    try: return pikepdf.PdfImage(obj).mode in ('RGB', 'L')
+    except Exception: return False
+
+def _walk_images(resources, page_size, found, seen_forms):
+    xobjects = resources.get('/XObject') if resources is not None else None
+    if xobjects is None: return
+    for name in list(xobjects.keys()):
+        obj = xobjects[name]
+        if not isinstance(obj, pikepdf.Stream): continue
+        subtype = obj.get('/Subtype')
+        if subtype == pikepdf.Name.Image: found.append((xobjects, name, obj, page_size))
+        elif subtype == pikepdf.Name.Form and obj.objgen not in seen_forms:
+            seen_forms.add(obj.objgen); _walk_images(obj.get('/Resources'), page_size, found, seen_forms)
+
+def _recompress_images(pdf_path, jobs, quality):
+    out = []
+    with pikepdf.open(pdf_path) as pdf:
+        for objgen, scale in jobs:
+            obj = pdf.get_object(objgen); raw_len = len(obj.read_raw_bytes())
+            w, h = int(obj.Width), int(obj.Height); size = (max(1, int(w * scale)), max(1, int(h * scale)))
+            if _image_filter(obj) == '/DCTDecode':
+                img = Image.open(io.BytesIO(_image_bytes(pdf, obj))); img.draft(img.mode, size)
+            else: img = pikepdf.PdfImage(obj).as_pil_image()
+            if img.size != size: img = img.resize(size, Image.LANCZOS)
+            b = io.BytesIO(); img.save(b, format='JPEG', quality=quality, optimize=True)
+            if b.tell() < raw_len: out.append((objgen, b.getvalue(), img.size))
+    return out
+
+def recompress_images(pdf_path, out_path, max_dpi=150, quality=70, min_bytes=32 * 1024, max_workers=None, progress=None):
+    stats = {'images': 0, 'recompressed': 0, 'deduplicated': 0}
+    with pikepdf.open(pdf_path) as pdf:
+        found, seen_forms = [], set()
+        for page in pdf.pages:
+            box = page.mediabox; page_size = (abs(float(box[2]) - float(box[0])), abs(float(box[3]) - float(box[1])))
+            _walk_images(page.obj.get('/Resources'), page_size, found, seen_forms)
+        canonical, scales = {}, {}
+        for xobjects, name, obj, (pw, ph) in found:
+            raw = obj.read_raw_bytes()
+            smask = obj.get('/SMask')
+            meta = [str(obj.get(k)) for k in ('/Width', '/Height', '/ColorSpace', '/BitsPerComponent', '/Filter', '/DecodeParms')]
+            key = hashlib.sha256(raw + repr((meta, smask.objgen if smask is not None else None)).encode()).digest()
+            first = canonical.setdefault(key, obj)
+            if first.objgen != obj.objgen: xobjects[name] = first; stats['deduplicated'] += 1; obj = first
+            if obj.objgen in scales or len(raw) < min_bytes or not _recompressible(obj): scales.setdefault(obj.objgen, None); continue
+            # The image can be drawn no larger than the page, so this is a lower bound on its effective DPI.
+            dpi = max(int(obj.Width) * 72 / max(pw, 1), int(obj.Height) * 72 / max(ph, 1))
+            scales[obj.objgen] = min(1.0, max_dpi / dpi) if dpi > 0 else 1.0
+        stats['images'] = len(scales)
+        jobs = [(objgen, scale) for objgen, scale in scales.items() if scale is not None]
+        n = max_workers or os.cpu_count() or 1
+        tasks = [(pdf_path, batch, quality) for batch in chunked(jobs, n * 4)] if jobs else []
+        for done, (_, results) in enumerate(run_tasks(_recompress_images, tasks, max_workers)):
+            for objgen, data, (w, h) in results:
+                obj = pdf.get_object(objgen); obj.write(data, filter=pikepdf.Name.DCTDecode)
+                obj.Width, obj.Height, obj.BitsPerComponent = w, h, 8
+                if '/DecodeParms' in obj: del obj['/DecodeParms']
+                stats['recompressed'] += 1
+            if progress: progress((done + 1) / len(tasks))
+        pdf.save(out_path, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    return stats
+
+# --- HELPER: PIPELINED OCR ---
+# A producer thread rasterizes page ranges to image files and hands them over through a
+# bounded queue, so only a few pages are ever on disk or in flight. Tesseract runs as
+# its own process, so the workers are threads that block on it; OMP_THREAD_LIMIT=1 in
+# that process's environment keeps each Tesseract single-threaded and lets the pool own
+# the cores without changing the environment of the server itself.
+def _queue_put(jobs, item, stop):
+    while not stop.is_set():
+        try: jobs.put(item, timeout=0.2); return True
+        except queue.Full: pass
+    return False
+
+def _render_ahead(src_path, pages, work_dir, dpi, poppler_path, chunk_size, jobs, stop):
+    try:
+        if pages is None: _queue_put(jobs, src_path, stop); return
+        for range_first, range_last in page_ranges(pages):
+            for first in range(range_first, range_last + 1, chunk_size):
+                common_args = {"dpi": dpi, "first_page": first + 1, "last_page": min(first + chunk_size - 1, range_last) + 1, "output_folder": work_dir, "output_file": f"page{first:06d}", "paths_only": True, "fmt": "ppm", "use_cropbox": True}
+                if poppler_path: paths = convert_from_path(src_path, poppler_path=poppler_path, **common_args)
+                else: paths = convert_from_path(src_path, **common_args)
+                for path in paths:
+                    if not _queue_put(jobs, path, stop): return
+    except Exception as e: _queue_put(jobs, e, stop)
+    finally: _queue_put(jobs, None, stop)
+
+# Tesseract's version is part of the cache key, so upgrading it invalidates old results.
+@functools.lru_cache(maxsize=None)
+def tesseract_version(tesseract_cmd=None):
+    import pytesseract
+    if tesseract_cmd: pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    return str(pytesseract.get_tesseract_version())
+
+def _run_tesseract(image_path, out_path, lang, tesseract_cmd=None, textonly=False):
+    import pytesseract
+    args = [tesseract_cmd or pytesseract.pytesseract.tesseract_cmd, image_path, os.path.splitext(out_path)[0], "-l", lang] + (["-c", "textonly_pdf=1"] if textonly else []) + ["pdf"]
+    result = subprocess.run(args, capture_output=True, env=dict(os.environ, OMP_THREAD_LIMIT="1"), creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+    if result.returncode != 0: raise RuntimeError(f"Tesseract failed: {result.stderr.decode(errors='replace').strip()}")
+    with open(out_path, "rb") as f: return f.read()
+
+def _ocr_page(image_path, out_path, lang, tesseract_cmd=None, keep_image=False, textonly=False, cache=None, cache_key=None):
+    data = None
+    if cache is not None:
+        with open(image_path, "rb") as f: cache_key = (hashlib.sha256(f.read()).hexdigest(),) + cache_key
+        data = cache.get(cache_key)
+    hit = data is not None
+    if not hit:
+        data = _run_tesseract(image_path, out_path, lang, tesseract_cmd, textonly)
+        if cache is not None: cache.put(cache_key, data)
+    else:
+        with open(out_path, "wb") as f: f.write(data)
+    if not keep_image: os.remove(image_path)
+    return out_path, hit
+
+# OCRs the given page indices (None for a single image file) and returns the per-page
+# PDF parts in page order plus the number of pages served from the cache. Cached
+# results are keyed by (page image hash, lang, dpi, Tesseract version, text-only).
+def _ocr_pipeline(src_path, pages, work_dir, lang, dpi, tesseract_cmd, poppler_path, chunk_size, max_workers, textonly=False, cache=None, progress=None):
+    workers = max_workers or os.cpu_count() or 1
+    total = len(pages) if pages is not None else 1
+    cache_key = (lang, dpi, tesseract_version(tesseract_cmd), textonly) if cache is not None else None
+    jobs, stop = queue.Queue(maxsize=workers * 2), threading.Event()
+    producer = threading.Thread(target=_render_ahead, args=(src_path, pages, work_dir, dpi, poppler_path, chunk_size, jobs, stop), daemon=True)
+    producer.start()
+    parts, pending, hits = [], deque(), 0
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                item = jobs.get()
+                if item is None: break
+                if isinstance(item, Exception): raise item
+                part = os.path.join(work_dir, f"ocr_{len(parts) + len(pending):06d}.pdf")
+                pending.append(executor.submit(_ocr_page, item, part, lang, tesseract_cmd, pages is None, textonly, cache, cache_key))
+                while pending and (len(pending) >= workers * 2 or pending[0].done()):
+                    part, hit = pending.popleft().result(); parts.append(part); hits += hit
+                    if progress: progress(len(parts) / total)
+            while pending:
+                part, hit = pending.popleft().result(); parts.append(part); hits += hit
+                if progress: progress(len(parts) / total)
+    finally:
+        stop.set(); producer.join()
+    return parts, hits
+
+def ocr_pdf(src_path, out_path, lang="eng", dpi=200, tesseract_cmd=None, poppler_path=None, chunk_size=4, max_workers=None, cache=None, progress=None):
+    pages = None
+    if src_path.lower().endswith(".pdf"):
+        with pikepdf.open(src_path) as pdf: pages = list(range(len(pdf.pages)))
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(out_path) or None) as work_dir:
+        parts, hits = _ocr_pipeline(src_path, pages, work_dir, lang, dpi, tesseract_cmd, poppler_path, chunk_size, max_workers, cache=cache, progress=progress)
+        concat_pdf_files(parts, out_path)
+    return {'pages': len(parts), 'ocr_pages': len(parts), 'cache_hits': hits, 'cache_misses': len(parts) - hits}
+
+# --- HELPER: TEXT LAYER DETECTION ---
+# A page is left alone when it already carries enough extractable text. Pages without
+# text only need OCR when images cover a meaningful part of them; the rest are blank.
+def _scan_text_layer(pdf_path, first_index, last_index, min_chars, min_image_coverage):
+    needs_ocr = []
+    reader = PdfReader(pdf_path)
+    with pdfplumber.open(pdf_path) as plumber:
+        for i in range(first_index, last_index + 1):
+            try: chars = len("".join((reader.pages[i].extract_text() or "").split()))
+            except Exception: chars = 0
+            if chars >= min_chars: needs_ocr.append(False); continue
+            page = plumber.pages[i]; area = float(page.width * page.height) or 1.0
+            covered = sum(max(0, min(img['x1'], page.width) - max(img['x0'], 0)) * max(0, min(img['bottom'], page.height) - max(img['top'], 0)) for img in page.images)
+            needs_ocr.append(covered / area >= min_image_coverage)
+    return needs_ocr
+
+def scan_text_layer(pdf_path, min_chars=20, min_image_coverage=0.1, max_workers=None):
+    with pikepdf.open(pdf_path) as pdf: total = len(pdf.pages)
+    ranges = page_range_tasks(total, max_workers)
+    needs_ocr = dict(run_tasks(_scan_text_layer, [(pdf_path, first, last, min_chars, min_image_coverage) for first, last in ranges], max_workers))
+    return [first + k for n, (first, last) in enumerate(ranges) for k, needed in enumerate(needs_ocr[n]) if needed], total
+
+# --- HELPER: TEXT LAYER PLACEMENT ---
+# Layers are drawn in displayed orientation, so they are mapped back through the page's
+# /Rotate onto its crop box. The original content stream is kept as-is (wrapped in q/Q);
+# the layer goes in its own appended stream.
+def display_size(page):
+    x0, y0, x1, y1 = [float(v) for v in page.cropbox]; w, h = abs(x1 - x0), abs(y1 - y0)
+    return (h, w) if int(page.obj.get('/Rotate', 0)) % 360 in (90, 270) else (w, h)
+
+def display_matrix(page, layer_box):
+    x0, y0, x1, y1 = [float(v) for v in page.cropbox]; x0, x1 = min(x0, x1), max(x0, x1); y0, y1 = min(y0, y1), max(y0, y1)
+    rotate = int(page.obj.get('/Rotate', 0)) % 360
+    lx0, ly0, lx1, ly1 = [float(v) for v in layer_box]
+    view_w, view_h = display_size(page)
+    sx, sy = view_w / ((lx1 - lx0) or 1), view_h / ((ly1 - ly0) or 1)
+    a, b, c, d, e, f = {0: (1, 0, 0, 1, x0, y0), 90: (0, 1, -1, 0, x1, y0), 180: (-1, 0, 0, -1, x1, y1), 270: (0, -1, 1, 0, x0, y1)}[rotate]
+    return pikepdf.Matrix(sx, 0, 0, sy, -lx0 * sx, -ly0 * sy) @ pikepdf.Matrix(a, b, c, d, e, f)
+
+def append_layer(page, ops):
+    page.contents_add(b'q\n', prepend=True)
+    page.contents_add(b'Q\n' + ops)
+
+def place_text_layer(pdf, page, layer_page):
+    formx = pdf.copy_foreign(layer_page.as_form_xobject())
+    name = page.add_resource(formx, pikepdf.Name.XObject)
+    append_layer(page, b'q ' + display_matrix(page, layer_page.mediabox).encode() + b' cm ' + bytes(name) + b' Do Q\n')
+
+# --- HELPER: OCR ONLY PAGES WITHOUT TEXT ---
+# Tesseract is asked for an invisible text-only layer, which is laid over the original
+# page; pages that already have text are copied through untouched.
+def ocr_missing_text(src_path, out_path, lang="eng", dpi=200, tesseract_cmd=None, poppler_path=None, chunk_size=4, max_workers=None, min_chars=20, cache=None, progress=None):
+    start = time.perf_counter()
+    pages, total = scan_text_layer(src_path, min_chars=min_chars, max_workers=max_workers)
+    scan_seconds = time.perf_counter() - start
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(out_path) or None) as work_dir:
+        start = time.perf_counter()
+        parts, hits = _ocr_pipeline(src_path, pages, work_dir, lang, dpi, tesseract_cmd, poppler_path, chunk_size, max_workers, textonly=True, cache=cache, progress=progress) if pages else ([], 0)
+        ocr_seconds = time.perf_counter() - start
+        with pikepdf.open(src_path) as pdf:
+            layers = []
+            try:
+                for page_index, part in zip(pages, parts):
+                    layers.append(pikepdf.open(part)); place_text_layer(pdf, pdf.pages[page_index], layers[-1].pages[0])
+                pdf.save(out_path, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+            finally:
+                for layer in layers: layer.close()
+    per_page = ocr_seconds / len(pages) if pages else None
+    return {'pages': total, 'ocr_pages': len(pages), 'skipped': total - len(pages), 'scan_seconds': scan_seconds, 'ocr_seconds': ocr_seconds, 'cache_hits': hits, 'cache_misses': len(pages) - hits,
+            'saved_seconds': (total - len(pages)) * per_page - scan_seconds if per_page is not None else None}
+
+# --- HELPER: TABLE PRE-FILTER ---
+# pdfplumber's default table finder builds cells from ruling lines only, so a page needs
+# at least two horizontal and two vertical edges to yield a table. Those are counted
+# straight from the content stream (including form XObjects) with pikepdf, which is far
+# cheaper than pdfplumber's layout analysis.
+def _ruling_edges(content, resources, depth=0):
+    h = v = 0; current = None
+    for operands, operator in pikepdf.parse_content_stream(content, "m l re Do"):
+        op = str(operator)
+        if op == "m": current = (float(operands[0]), float(operands[1]))
+        elif op == "l" and current is not None:
+            x, y = float(operands[0]), float(operands[1])
+            if abs(y - current[1]) <= 1 and abs(x - current[0]) > 1: h += 1
+            elif abs(x - current[0]) <= 1 and abs(y - current[1]) > 1: v += 1
+            current = (x, y)
+        elif op == "re":
+            w, rh = abs(float(operands[2])), abs(float(operands[3]))
+            if rh <= 2 and w > 2: h += 1
+            elif w <= 2 and rh > 2: v += 1
+            elif w > 2 and rh > 2: h += 2; v += 2
+        elif op == "Do" and depth < 4 and resources is not None and '/XObject' in resources:
+            xobj = resources.XObject.get(operands[0])
+            if xobj is not None and xobj.get('/Subtype') == pikepdf.Name.Form:
+                fh, fv = _ruling_edges(xobj, xobj.get('/Resources'), depth + 1); h += fh; v += fv
+    return h, v
+
+def has_table_structure(page):
+    try: h, v = _ruling_edges(page, page.obj.get('/Resources'))
+    except Exception: return True
+    return h >= 2 and v >= 2
+
+# --- HELPER: PARALLEL TABLE EXTRACTION ---
+# Workers open the document themselves and extract tables from a page range; results
+# come back in page order and each table is written to the workbook as it arrives.
+def _extract_tables_range(pdf_path, first_index, last_index, prefilter=True):
+    out, skipped, scan_seconds, extract_seconds = [], 0, 0.0, 0.0
+    with pikepdf.open(pdf_path) as doc, pdfplumber.open(pdf_path) as pdf:
+        for i in range(first_index, last_index + 1):
+            if prefilter:
+                start = time.perf_counter(); candidate = has_table_structure(doc.pages[i]); scan_seconds += time.perf_counter() - start
+                if not candidate: skipped += 1; continue
+            start = time.perf_counter()
+            page = pdf.pages[i]; out.append((i, page.extract_tables())); page.close()
+            extract_seconds += time.perf_counter() - start
+    return out, skipped, scan_seconds, extract_seconds
+
+def page_range_tasks(total, max_workers=None, per_worker=4):
+    return [(c[0], c[-1]) for c in chunked(list(range(total)), (max_workers or os.cpu_count() or 1) * per_worker)] if total else []
+
+def tables_to_excel(pdf_path, out_path, prefilter=True, max_workers=None, progress=None):
+    with pikepdf.open(pdf_path) as pdf: total = len(pdf.pages)
+    ranges = page_range_tasks(total, max_workers)
+    report = {'tables': 0, 'pages': total, 'skipped': 0, 'scan_seconds': 0.0, 'extract_seconds': 0.0}
+    with pd.ExcelWriter(out_path, engine='xlsxwriter') as writer:
+        for done, (_, (page_tables, skipped, scan_seconds, extract_seconds)) in enumerate(run_tasks_ordered(_extract_tables_range, [(pdf_path, first, last, prefilter) for first, last in ranges], max_workers)):
+            report['skipped'] += skipped; report['scan_seconds'] += scan_seconds; report['extract_seconds'] += extract_seconds
+            for _, tables in page_tables:
+                for table in tables:
+                    report['tables'] += 1; pd.DataFrame(table).to_excel(writer, sheet_name=f"Table_{report['tables']}", index=False, header=False)
+            if progress: progress((done + 1) / len(ranges))
+    extracted = total - report['skipped']
+    report['saved_seconds'] = report['skipped'] * report['extract_seconds'] / extracted - report['scan_seconds'] if extracted and report['skipped'] else None
+    return report
+
+# --- HELPER: CHUNKED PDF TO WORD ---
+# pdf2docx converts page ranges in worker processes; the parts are stitched into the
+# first one with python-docx. Related parts referenced from the copied XML (images,
+# hyperlinks) are re-created in the target document and the r:ids rewritten.
+def _convert_docx_chunk(pdf_path, start, end, out_path):
+    from pdf2docx import Converter
+    cv = Converter(pdf_path)
+    try: cv.convert(out_path, start=start, end=end)
+    finally: cv.close()
+    return out_path
+
+def _relink_parts(element, src_part, dst_part):
+    from docx.opc.constants import RELATIONSHIP_TYPE as RT
+    r_ns = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+    for node in element.iter():
+        for attr, r_id in list(node.attrib.items()):
+            if not attr.startswith(r_ns) or r_id not in src_part.rels: continue
+            rel = src_part.rels[r_id]
+            if rel.is_external: node.set(attr, dst_part.relate_to(rel.target_ref, rel.reltype, is_external=True))
+            elif rel.reltype == RT.IMAGE: node.set(attr, dst_part.get_or_add_image(io.BytesIO(rel.target_part.blob))[0])
+            else: node.set(attr, dst_part.relate_to(rel.target_part, rel.reltype))
+
+def stitch_docx(paths, out_path):
+    from docx import Document
+    from docx.oxml.ns import qn
+    from docx.oxml import OxmlElement
+    base = Document(paths[0]); body = base.element.body
+    for path in paths[1:]:
+        part = Document(path); src_body = part.element.body
+        # The previous part's final section becomes an explicit section break.
+        last_sect = body.find(qn('w:sectPr'))
+        if last_sect is not None:
+            p = OxmlElement('w:p'); ppr = OxmlElement('w:pPr'); ppr.append(copy.deepcopy(last_sect)); p.append(ppr); last_sect.addprevious(p)
+        for child in src_body.iterchildren():
+            if child.tag == qn('w:sectPr'): continue
+            new = copy.deepcopy(child); _relink_parts(new, part.part, base.part)
+            if last_sect is not None: last_sect.addprevious(new)
+            else: body.append(new)
+        src_sect = src_body.find(qn('w:sectPr'))
+        if src_sect is not None:
+            if last_sect is not None: body.replace(last_sect, copy.deepcopy(src_sect))
+            else: body.append(copy.deepcopy(src_sect))
+    base.save(out_path)
+    return out_path
+
+def pdf_to_docx_chunked(pdf_path, out_path, chunk_pages=10, max_workers=None, progress=None):
+    with pikepdf.open(pdf_path) as pdf: total = len(pdf.pages)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(out_path) or None) as work_dir:
+        tasks = [(pdf_path, start, min(start + chunk_pages, total), os.path.join(work_dir, f"part_{start:06d}.docx")) for start in range(0, total, chunk_pages)]
+        # Cancel (a rerun raised from progress) terminates the chunks still converting.
+        with contextlib.closing(run_tasks(_convert_docx_chunk, tasks, max_workers, kill_on_stop=True)) as results:
+            for done, (i, _) in enumerate(results):
+                if progress: progress(done + 1, len(tasks), tasks[i][1], tasks[i][2])
+        stitch_docx([t[3] for t in tasks], out_path)
+    return len(tasks)
+
+# --- HELPER: STREAMING TEXT EXTRACTION ---
+# Fixed-size page ranges keep the time to the first pages independent of document
+# length; the submission window bounds how much extracted text is waiting in memory.
+def _extract_text_range(pdf_path, first_index, last_index):
+    reader = PdfReader(pdf_path)
+    return [reader.pages[i].extract_text() or "" for i in range(first_index, last_index + 1)]
+
+def iter_page_text(pdf_path, chunk_pages=16, max_workers=None):
+    with pikepdf.open(pdf_path) as pdf: total = len(pdf.pages)
+    tasks = [(pdf_path, first, min(first + chunk_pages, total) - 1) for first in range(0, total, chunk_pages)]
+    workers = max_workers or os.cpu_count() or 1
+    for _, texts in run_tasks_ordered(_extract_text_range, tasks, max_workers, window=workers * 2):
+        yield from texts
+
+# Pass page texts (e.g. from a PageIndex) to skip extraction.
+def text_to_file(pdf_path, out_path, preview=None, preview_chars=500, max_workers=None, progress=None, texts=None):
+    if texts is None:
+        with pikepdf.open(pdf_path) as pdf: total = len(pdf.pages)
+    else: total = len(texts)
+    head = []; head_len = 0
+    with open(out_path, "w", encoding="utf-8") as f:
+        for i, text in enumerate(texts if texts is not None else iter_page_text(pdf_path, max_workers=max_workers)):
+            f.write(text); f.write("\n\n")
+            if head is not None:
+                head.append(text + "\n\n"); head_len += len(text) + 2
+                if head_len >= preview_chars or i + 1 == total:
+                    if preview: preview("".join(head)[:preview_chars])
+                    head = None
+            if progress: progress((i + 1) / total)
+    return total
+
+# --- HELPER: EDITABLE PPTX LAYOUT ---
+# Words are sorted by their top edge and a new line starts wherever the gap to the previous
+# word exceeds a fraction of the median word height, so words a fraction of a point apart
+# stay on one line. Line boxes are reduced per line with NumPy.
+# Returns [(text, x0, top, width, height, avg_size)] from top to bottom.
+def group_lines(words, tolerance=0.5):
+    n = len(words)
+    if not n: return []
+    x0 = np.fromiter((w['x0'] for w in words), float, n); x1 = np.fromiter((w['x1'] for w in words), float, n)
+    top = np.fromiter((w['top'] for w in words), float, n); bottom = np.fromiter((w['bottom'] for w in words), float, n)
+    size = np.fromiter((w.get('size', w['bottom'] - w['top']) for w in words), float, n)
+    tol = tolerance * max(float(np.median(bottom - top)), 1.0)
+    by_top = np.argsort(top, kind='stable'); line_id = np.empty(n, dtype=np.int64)
+    line_id[by_top] = np.concatenate(([0], np.cumsum(np.diff(top[by_top]) > tol)))
+    order = np.lexsort((x0, line_id)); ids = line_id[order]
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]); counts = np.diff(np.r_[starts, n])
+    line_x0 = np.minimum.reduceat(x0[order], starts); line_top = np.minimum.reduceat(top[order], starts)
+    widths = np.add.reduceat((x1 - x0)[order], starts) + counts * 3
+    heights = np.maximum.reduceat((bottom - top)[order], starts)
+    sizes = np.add.reduceat(size[order], starts) / counts
+    texts = [words[k]['text'] for k in order]
+    return [(" ".join(texts[s:s + c]), float(a), float(t), float(w), float(h), float(z))
+            for s, c, a, t, w, h, z in zip(starts.tolist(), counts.tolist(), line_x0, line_top, widths, heights, sizes)]
+
+def _layout_range(pdf_path, first_index, last_index, tolerance=0.5):
+    out = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for i in range(first_index, last_index + 1):
+            page = pdf.pages[i]
+            out.append((float(page.width), float(page.height), group_lines(page.extract_words(extra_attrs=["fontname", "size"]), tolerance)))
+            page.close()
+    return out
+
+# Yields (page_width, page_height, lines) per page, in page order.
+def iter_page_lines(pdf_path, tolerance=0.5, max_workers=None):
+    with pikepdf.open(pdf_path) as pdf: total = len(pdf.pages)
+    tasks = [(pdf_path, first, last, tolerance) for first, last in page_range_tasks(total, max_workers)]
+    for _, pages in run_tasks_ordered(_layout_range, tasks, max_workers):
+        yield from pages
+
+# --- HELPER: IMAGE-BASED PPTX ---
+# Workers render small page chunks and encode each page for its content: pages with few
+# distinct colours (text, line art) as optimized PNG, everything else as JPEG. The parent
+# adds slides chunk by chunk in page order and deletes the encoded files as it goes, so
+# only workers x chunk_size rasters exist at any time.
+# Line art is dominated by a handful of exact colours; the sample is taken with nearest-
+# neighbour scaling so resampling does not invent new shades.
+def is_line_art(img, top_colors=16, min_share=0.9):
+    scale = min(1.0, 256 / max(img.size)); sample = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.NEAREST)
+    counts = sorted((n for n, _ in sample.getcolors(sample.width * sample.height)), reverse=True)
+    return sum(counts[:top_colors]) >= min_share * sample.width * sample.height
+
+def _encode_slide_chunk(pdf_path, first_index, last_index, dpi, quality, out_dir, poppler_path=None):
+    common_args = {"dpi": dpi, "first_page": first_index + 1, "last_page": last_index + 1}
+    if poppler_path: images = convert_from_path(pdf_path, poppler_path=poppler_path, **common_args)
+    else: images = convert_from_path(pdf_path, **common_args)
+    out = []
+    for i, img in enumerate(images):
+        if img.mode != "RGB": img = img.convert("RGB")
+        if is_line_art(img):
+            path = os.path.join(out_dir, f"slide_{first_index + i:06d}.png"); img.save(path, format="PNG", optimize=True)
+        else:
+            path = os.path.join(out_dir, f"slide_{first_index + i:06d}.jpg"); img.save(path, format="JPEG", quality=quality, optimize=True)
+        out.append((path, img.size))
+    return out
+
+def pdf_to_image_pptx(pdf_path, out_path, dpi=150, quality=85, poppler_path=None, chunk_size=4, max_workers=None, progress=None):
+    from pptx import Presentation
+    from pptx.util import Inches
+    with pikepdf.open(pdf_path) as pdf: total = len(pdf.pages)
+    prs = Presentation(); blank_slide_layout = prs.slide_layouts[6]; added = 0
+    workers = max_workers or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(out_path) or None) as work_dir:
+        tasks = [(pdf_path, first, min(first + chunk_size, total) - 1, dpi, quality, work_dir, poppler_path) for first in range(0, total, chunk_size)]
+        for _, pages in run_tasks_ordered(_encode_slide_chunk, tasks, max_workers, window=workers * 2):
+            for path, (width_px, height_px) in pages:
+                if added == 0: prs.slide_width = Inches(10); prs.slide_height = Inches(10 * height_px / width_px)
+                slide = prs.slides.add_slide(blank_slide_layout); slide.shapes.add_picture(path, 0, 0, width=prs.slide_width, height=prs.slide_height)
+                os.remove(path); added += 1
+                if progress: progress(added / total)
+    prs.save(out_path)
+    return added
+
+# --- HELPER: PDF TO IMAGES ---
+# Workers render small page chunks and save them straight to files in the chosen format;
+# the parent moves finished pages into the ZIP on disk in page order and deletes them, so
+# only workers x chunk_size rasters exist at any time. Formats that are already
+# compressed are stored in the ZIP as-is.
+IMAGE_FORMATS = {"JPEG": ("jpg", "image/jpeg"), "PNG": ("png", "image/png"), "TIFF": ("tif", "image/tiff")}
+if features.check("webp"): IMAGE_FORMATS["WEBP"] = ("webp", "image/webp")
+
+def _save_image(img, path, fmt, quality):
+    if fmt == "JPEG": img.save(path, format="JPEG", quality=quality, optimize=True)
+    elif fmt == "PNG": img.save(path, format="PNG", optimize=True)
+    elif fmt == "WEBP": img.save(path, format="WEBP", quality=quality, method=4)
+    else: img.save(path, format="TIFF", compression="tiff_deflate")
+
+def _export_image_chunk(pdf_path, first_index, last_index, dpi, fmt, grayscale, quality, out_dir, poppler_path=None):
+    common_args = {"dpi": dpi, "first_page": first_index + 1, "last_page": last_index + 1, "grayscale": grayscale}
+    if poppler_path: images = convert_from_path(pdf_path, poppler_path=poppler_path, **common_args)
+    else: images = convert_from_path(pdf_path, **common_args)
+    out = []
+    for i, img in enumerate(images):
+        if fmt == "JPEG" and img.mode not in ("RGB", "L"): img = img.convert("RGB")
+        path = os.path.join(out_dir, f"page_{first_index + i + 1:06d}.{IMAGE_FORMATS[fmt][0]}"); _save_image(img, path, fmt, quality); out.append(path)
+    return out
+
+# Returns the member names in page order and small previews of the first pages.
+def images_to_zip(pdf_path, zip_path, dpi=150, fmt="JPEG", grayscale=False, quality=85, poppler_path=None, chunk_size=4, preview_pages=4, preview_width=300, max_workers=None, progress=None):
+    with pikepdf.open(pdf_path) as pdf: total = len(pdf.pages)
+    ext = IMAGE_FORMATS[fmt][0]; names, previews = [], []
+    workers = max_workers or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(zip_path) or None) as work_dir, zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as zf:
+        tasks = [(pdf_path, first, min(first + chunk_size, total) - 1, dpi, fmt, grayscale, quality, work_dir, poppler_path) for first in range(0, total, chunk_size)]
+        for _, paths in run_tasks_ordered(_export_image_chunk, tasks, max_workers, window=workers * 2):
+            for path in paths:
+                names.append(f"page_{len(names) + 1}.{ext}"); zf.write(path, names[-1])
+                if len(previews) < preview_pages:
+                    with Image.open(path) as img: img.thumbnail((preview_width, preview_width * 4)); previews.append(img.copy())
+                os.remove(path)
+                if progress: progress(len(names) / total)
+    return names, previews
+
+# --- HELPER: PAGE BOX EDITS ---
+# Rotate and Crop only change /Rotate and /CropBox in page dictionaries. The document is
+# saved with its streams copied undecoded and its object streams kept, or, incremental,
+# the original bytes are copied and only the changed page objects are appended as an
+# update section (a cross-reference stream when the original uses one).
+# rotations: {page_index: degrees} added to each page's rotation; crop: margins
+# (left, bottom, right, top) in points, applied to every page.
+def _startxref(path):
+    with open(path, "rb") as f:
+        f.seek(max(0, os.path.getsize(path) - 1024)); tail = f.read()
+    pos = tail.rfind(b"startxref"); offset = int(tail[pos + 9:].split()[0])
+    with open(path, "rb") as f: f.seek(offset); is_stream = not f.read(4).startswith(b"xref")
+    return offset, is_stream
+
+def _append_update(src_path, out_path, pdf, objects):
+    prev, xref_stream = _startxref(src_path); shutil.copyfile(src_path, out_path)
+    size = int(pdf.trailer.Size); entries = []
+    trailer = {'/Size': size + 1 if xref_stream else size, '/Root': pdf.trailer.Root, '/Prev': prev}
+    for key in ('/Info', '/ID'):
+        if key in pdf.trailer: trailer[key] = pdf.trailer[key]
+    with open(out_path, "r+b") as f:
+        f.seek(0, os.SEEK_END); offset = f.tell(); body = b"\n"
+        for obj in objects:
+            num, gen = obj.objgen; entries.append((num, gen, offset + len(body)))
+            body += f"{num} {gen} obj\n".encode() + obj.unparse(resolved=True) + b"\nendobj\n"
+        start = offset + len(body)
+        if xref_stream:
+            entries.append((size, 0, start)); entries.sort(); width = max(4, (start.bit_length() + 7) // 8)
+            rows = b"".join(b"\x01" + off.to_bytes(width, "big") + gen.to_bytes(2, "big") for num, gen, off in entries)
+            xref = pikepdf.Dictionary(Type=pikepdf.Name.XRef, W=[1, width, 2], Index=[v for num, _, _ in entries for v in (num, 1)], Length=len(rows), **{k[1:]: v for k, v in trailer.items()})
+            body += f"{size} 0 obj\n".encode() + xref.unparse() + b"\nstream\n" + rows + b"\nendstream\nendobj\n"
+        else:
+            entries.sort(); body += b"xref\n0 1\n0000000000 65535 f \n" + b"".join(f"{num} 1\n{off:010d} {gen:05d} n \n".encode() for num, gen, off in entries)
+            body += b"trailer\n" + pikepdf.Dictionary({k: v for k, v in trailer.items()}).unparse() + b"\n"
+        f.write(body + f"startxref\n{start}\n%%EOF\n".encode())
+    return out_path
+
+def edit_page_boxes(src_path, out_path, rotations=None, crop=None, incremental=False):
+    with pikepdf.open(src_path) as pdf:
+        changed = []
+        for i, page in enumerate(pdf.pages):
+            angle = (rotations or {}).get(i, 0) % 360
+            if angle: page.rotate(angle, relative=True)
+            if crop:
+                left, bottom, right, top = crop; urx, ury = float(page.mediabox[2]), float(page.mediabox[3])
+                page.cropbox = pikepdf.Array([left, bottom, urx - right, ury - top])
+            if angle or crop: changed.append(page.obj)
+        if incremental and not pdf.is_encrypted and not pdf.get_warnings(): return _append_update(src_path, out_path, pdf, changed)
+        pdf.save(out_path, object_stream_mode=pikepdf.ObjectStreamMode.preserve, stream_decode_level=pikepdf.StreamDecodeLevel.none)
+    return out_path
+
+# --- HELPER: STAMPING ENGINE ---
+# Watermarks, page numbers and headers/footers are described by a plain stamp dict:
+#   {'kind': 'watermark', 'text', 'font', 'size', 'rgb', 'opacity', 'rotation', 'tiled', 'gap_x', 'gap_y', 'position', 'xy'}
+#   {'kind': 'text', 'text', 'font', 'size', 'rgb', 'opacity', 'position', 'margin'}
+# where 'text' may contain {page} and {total}. Each distinct overlay is drawn once with
+# reportlab per displayed page size and shared by all pages as a Form XObject. Text that
+# changes per page in a standard font is written as a tiny content stream against one
+# shared font resource instead of a new overlay per page.
+def watermark_anchor(position, width, height, xy=None, margin=50):
+    if position == "Custom (Manual X/Y)": return xy
+    x = width / 2 if "Center" in position else margin if "Left" in position else width - margin if "Right" in position else 0
+    y = height - margin if "Top" in position else margin if "Bottom" in position else height / 2 if "Center" in position else 0
+    return x, y
+
+def stamp_text(stamp, page_num=1, total=1):
+    return stamp.get('text', '').replace("{page}", str(page_num)).replace("{total}", str(total))
+
+def draw_stamp(c, width, height, stamp, text):
+    c.setFillColorRGB(*stamp['rgb'], alpha=stamp['opacity']); c.setFont(stamp['font'], stamp['size'])
+    if stamp['kind'] == 'watermark':
+        c.saveState()
+        if stamp.get('tiled'):
+            c.rotate(stamp['rotation']); gap_x = stamp['gap_x'] + len(text) * 2
+            for x in range(-int(width * 2), int(width * 2), gap_x):
+                for y in range(-int(height * 2), int(height * 2), stamp['gap_y']): c.drawString(x, y, text)
+        else:
+            x, y = watermark_anchor(stamp['position'], width, height, stamp.get('xy'))
+            c.translate(x, y); c.rotate(stamp['rotation']); c.drawCentredString(0, 0, text)
+        c.restoreState()
+    else:
+        margin = stamp.get('margin', 20); position = stamp['position']; y = margin if "Bottom" in position else height - margin
+        if "Left" in position: c.drawString(margin, y, text)
+        elif "Right" in position: c.drawRightString(width - margin, y, text)
+        else: c.drawCentredString(width / 2, y, text)
+
+def render_stamp(width, height, stamp, text):
+    buf = io.BytesIO(); c = canvas.Canvas(buf, pagesize=(width, height)); draw_stamp(c, width, height, stamp, text); c.save()
+    return buf.getvalue()
+
+# Custom TrueType fonts are registered in the Streamlit process only; workers register
+# them again from the font file.
+def font_file(font):
+    if not font or font in pdfmetrics.standardFonts: return None
+    try: return getattr(getattr(pdfmetrics.getFont(font), 'face', None), 'filename', None)
+    except KeyError: return None
+
+def _load_font(stamp):
+    if stamp.get('font_path') and stamp['font'] not in pdfmetrics.getRegisteredFontNames():
+        from reportlab.pdfbase.ttfonts import TTFont
+        pdfmetrics.registerFont(TTFont(stamp['font'], stamp['font_path']))
+
+def _render_stamp_range(stamp, pages, out_path):
+    _load_font(stamp); c = canvas.Canvas(out_path)
+    for width, height, text in pages:
+        c.setPageSize((width, height)); draw_stamp(c, width, height, stamp, text); c.showPage()
+    c.save()
+    return out_path
+
+def _pdf_string(text):
+    return b'(' + text.encode('cp1252', 'replace').replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+class Stamper:
+    def __init__(self, pdf, stamp, total):
+        self.pdf = pdf; self.stamp = stamp; self.total = total
+        self.forms = {}; self.sources = []; self.font = self.gstate = None
+        self.per_page = "{page}" in stamp.get('text', '') or "{total}" in stamp.get('text', '')
+        self.inline = self.per_page and stamp['kind'] == 'text' and stamp['font'] in pdfmetrics.standardFonts
+
+    def _form(self, width, height, text):
+        key = (round(width, 2), round(height, 2), text)
+        if key not in self.forms:
+            self.sources.append(pikepdf.open(io.BytesIO(render_stamp(width, height, self.stamp, text))))
+            self.forms[key] = self.pdf.copy_foreign(self.sources[-1].pages[0].as_form_xobject())
+        return self.forms[key]
+
+    def _text_ops(self, page, width, height, text):
+        if self.font is None:
+            self.font = self.pdf.make_indirect(pikepdf.Dictionary(Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1, BaseFont=pikepdf.Name('/' + self.stamp['font']), Encoding=pikepdf.Name.WinAnsiEncoding))
+            self.gstate = self.pdf.make_indirect(pikepdf.Dictionary(Type=pikepdf.Name.ExtGState, ca=self.stamp['opacity'], CA=self.stamp['opacity']))
+        font, size, margin, position = self.stamp['font'], self.stamp['size'], self.stamp.get('margin', 20), self.stamp['position']
+        text_w = pdfmetrics.stringWidth(text, font, size)
+        x = margin if "Left" in position else width - margin - text_w if "Right" in position else (width - text_w) / 2
+        y = margin if "Bottom" in position else height - margin
+        font_name = page.add_resource(self.font, pikepdf.Name.Font); gs_name = page.add_resource(self.gstate, pikepdf.Name.ExtGState)
+        r, g, b = self.stamp['rgb']
+        return (bytes(gs_name) + b' gs ' + f"{r:.4f} {g:.4f} {b:.4f} rg BT ".encode() + bytes(font_name) + f" {size:g} Tf {x:.2f} {y:.2f} Td ".encode() + _pdf_string(text) + b' Tj ET')
+
+    # form: a Form XObject already rendered for this page (see stamp_pdf)
+    def apply(self, page, page_num, form=None):
+        width, height = display_size(page); text = stamp_text(self.stamp, page_num, self.total)
+        matrix = display_matrix(page, (0, 0, width, height)).encode()
+        if self.inline: ops = self._text_ops(page, width, height, text)
+        else: ops = bytes(page.add_resource(form if form is not None else self._form(width, height, text if self.per_page else self.stamp.get('text', '')), pikepdf.Name.XObject)) + b' Do'
+        append_layer(page, b'q ' + matrix + b' cm ' + ops + b' Q\n')
+
+    def close(self):
+        for src in self.sources: src.close()
+        self.sources = []
+
+# Shared overlays are drawn once, so only per-page overlays (text that changes per page in
+# a custom font) are worth a process: workers render them for page ranges into one
+# multi-page PDF each, and the parent places them in page order and writes the document
+# once, so outlines, links and forms of the source are kept.
+def stamp_pdf(src_path, out_path, stamp, chunk_pages=64, max_workers=None, progress=None):
+    workers = max_workers or os.cpu_count() or 1
+    with pikepdf.open(src_path) as pdf:
+        total = len(pdf.pages); stamper = Stamper(pdf, stamp, total)
+        targets = list(range(total))
+        try:
+            if stamper.per_page and not stamper.inline and len(targets) > chunk_pages:
+                stamp = dict(stamp, font_path=font_file(stamp.get('font')))
+                items = [(i,) + display_size(pdf.pages[i]) + (stamp_text(stamp, i + 1, total),) for i in targets]
+                chunks = chunked(items, max(workers * 2, -(-len(items) // 512)))
+                with tempfile.TemporaryDirectory(dir=os.path.dirname(out_path) or None) as work_dir:
+                    tasks = [(stamp, [item[1:] for item in chunk], os.path.join(work_dir, f"overlay_{n:05d}.pdf")) for n, chunk in enumerate(chunks)]
+                    for n, path in run_tasks_ordered(_render_stamp_range, tasks, workers, window=workers * 2):
+                        stamper.sources.append(pikepdf.open(path))
+                        for (i, *_), overlay in zip(chunks[n], stamper.sources[-1].pages):
+                            stamper.apply(pdf.pages[i], i + 1, form=pdf.copy_foreign(overlay.as_form_xobject()))
+                        if progress: progress((n + 1) / len(chunks))
+                    pdf.save(out_path, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+                    stamper.close()
+            else:
+                for n, i in enumerate(targets):
+                    stamper.apply(pdf.pages[i], i + 1)
+                    if progress and (n % 50 == 49 or n + 1 == len(targets)): progress((n + 1) / len(targets))
+                pdf.save(out_path, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+        finally: stamper.close()
+    return total
+
+# --- HELPER: SIGNATURE PLACEMENT ---
+# The signature is embedded once as an Image XObject (transparency kept as an /SMask) and
+# drawn on each selected page through its display matrix while the queue is assembled, so
+# signing saves the document once and grows it by one image whatever the page count.
+def image_xobject(pdf, img):
+    if img.mode in ("P", "PA", "LA") or 'transparency' in img.info: img = img.convert("RGBA")
+    alpha = img.getchannel("A") if img.mode == "RGBA" else None
+    if img.mode not in ("RGB", "L"): img = img.convert("RGB")
+    def stream(im):
+        return pdf.make_stream(zlib.compress(im.tobytes()), Type=pikepdf.Name.XObject, Subtype=pikepdf.Name.Image, Width=im.width, Height=im.height,
+                               ColorSpace=pikepdf.Name.DeviceGray if im.mode == "L" else pikepdf.Name.DeviceRGB, BitsPerComponent=8, Filter=pikepdf.Name.FlateDecode)
+    xobj = stream(img)
+    if alpha is not None and alpha.getextrema() != (255, 255): xobj.SMask = stream(alpha)
+    return xobj
+
+# placement: (x, y, width, height) in displayed page coordinates; pages: queue positions
+# to sign (all when None).
+def sign_pages(docs, records, output, image, placement, pages=None):
+    x, y, width, height = placement; shared = {}
+    def place(pdf, page, n):
+        if pages is not None and n not in pages: return
+        if 'image' not in shared: shared['image'] = image_xobject(pdf, image)
+        view_w, view_h = display_size(page); name = page.add_resource(shared['image'], pikepdf.Name.XObject)
+        matrix = pikepdf.Matrix(width, 0, 0, height, x, y) @ display_matrix(page, (0, 0, view_w, view_h))
+        append_layer(page, b'q ' + matrix.encode() + b' cm ' + bytes(name) + b' Do Q\n')
+    return merge_pages(docs, records, output, on_page=place)
+
+# --- HELPER: STAMP PREVIEW ---
+# Live previews composite the stamp onto a cached raster of the page with PIL instead of
+# writing and rendering a new PDF. Anchor points use the same reportlab metrics as the
+# real stamp; glyphs come from the custom font file or a close system font.
+PREVIEW_FONTS = {
+    "Helvetica": ["arial.ttf", "LiberationSans-Regular.ttf", "DejaVuSans.ttf"], "Helvetica-Bold": ["arialbd.ttf", "LiberationSans-Bold.ttf", "DejaVuSans-Bold.ttf"],
+    "Times-Roman": ["times.ttf", "LiberationSerif-Regular.ttf", "DejaVuSerif.ttf"], "Times-Bold": ["timesbd.ttf", "LiberationSerif-Bold.ttf", "DejaVuSerif-Bold.ttf"],
+    "Courier": ["cour.ttf", "LiberationMono-Regular.ttf", "DejaVuSansMono.ttf"], "Courier-Bold": ["courbd.ttf", "LiberationMono-Bold.ttf", "DejaVuSansMono-Bold.ttf"],
+}
+
+@functools.lru_cache(maxsize=64)
+def preview_font(font, size_px):
+    for candidate in [font_file(font)] + PREVIEW_FONTS.get(font, PREVIEW_FONTS["Helvetica"]):
+        if not candidate: continue
+        try: return ImageFont.truetype(candidate, size_px)
+        except OSError: pass
+    try: return ImageFont.load_default(size_px)
+    except TypeError: return ImageFont.load_default()
+
+# Returns the sprite and the pixel position of the text anchor inside it.
+def _text_sprite(text, font, fill, angle, anchor):
+    left, top, right, bottom = font.getbbox(text, anchor=anchor)
+    w, h = max(1, right - left), max(1, bottom - top)
+    sprite = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+    ImageDraw.Draw(sprite).text((-left, -top), text, font=font, fill=fill, anchor=anchor)
+    if not angle % 360: return sprite, (-left, -top)
+    sprite = sprite.rotate(angle, resample=Image.BICUBIC, expand=True)
+    vx, vy = -left - w / 2, -top - h / 2; cos_a, sin_a = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    return sprite, (sprite.width / 2 + vx * cos_a + vy * sin_a, sprite.height / 2 - vx * sin_a + vy * cos_a)
+
+def _composite(img, sprite, x, y):
+    x, y = int(round(x)), int(round(y)); sx, sy = max(0, -x), max(0, -y); x, y = max(0, x), max(0, y)
+    if sx < sprite.width and sy < sprite.height and x < img.width and y < img.height: img.alpha_composite(sprite, (x, y), (sx, sy))
+
+# base: displayed raster of the page; page_size: its displayed size in points.
+def preview_stamp(base, page_size, stamp, text):
+    img = base.convert("RGBA"); w_pt, h_pt = page_size; scale = img.width / w_pt
+    font = preview_font(stamp['font'], max(1, int(round(stamp['size'] * scale))))
+    fill = tuple(int(round(v * 255)) for v in stamp['rgb']) + (int(round(stamp['opacity'] * 255)),)
+    if stamp['kind'] == 'watermark' and stamp.get('tiled'):
+        sprite, (ox, oy) = _text_sprite(text, font, fill, stamp['rotation'], "ls")
+        cos_a, sin_a = math.cos(math.radians(stamp['rotation'])), math.sin(math.radians(stamp['rotation'])); pad = max(sprite.size) / scale
+        for x in range(-int(w_pt * 2), int(w_pt * 2), stamp['gap_x'] + len(text) * 2):
+            for y in range(-int(h_pt * 2), int(h_pt * 2), stamp['gap_y']):
+                px, py = x * cos_a - y * sin_a, x * sin_a + y * cos_a
+                if -pad <= px <= w_pt + pad and -pad <= py <= h_pt + pad: _composite(img, sprite, px * scale - ox, (h_pt - py) * scale - oy)
+        return img
+    if stamp['kind'] == 'watermark':
+        (x, y), angle, anchor = watermark_anchor(stamp['position'], w_pt, h_pt, stamp.get('xy')), stamp['rotation'], "ms"
+    else:
+        margin = stamp.get('margin', 20); position = stamp['position']; angle = 0
+        y = margin if "Bottom" in position else h_pt - margin
+        x, anchor = (margin, "ls") if "Left" in position else (w_pt - margin, "rs") if "Right" in position else (w_pt / 2, "ms")
+    sprite, (ox, oy) = _text_sprite(text, font, fill, angle, anchor)
+    _composite(img, sprite, x * scale - ox, (h_pt - y) * scale - oy)
+    return img
+
+# base: displayed raster of the page's crop box. The new crop box is placed as in
+# edit_page_boxes (margins in unrotated user space against the media box); the raster is
+# turned back to unrotated, everything outside the new box is shaded, and it is turned again.
+def preview_crop(base, cropbox, mediabox, rotation, left, bottom, right, top):
+    cx0, cx1, cy1 = min(cropbox[0], cropbox[2]), max(cropbox[0], cropbox[2]), max(cropbox[1], cropbox[3])
+    img = (base.rotate(rotation, expand=True) if rotation else base).convert("RGBA")
+    scale = img.width / ((cx1 - cx0) or 1)
+    x0, y0, x1, y1 = left, bottom, float(mediabox[2]) - right, float(mediabox[3]) - top
+    box = (int(round((x0 - cx0) * scale)), int(round((cy1 - y1) * scale)), int(round((x1 - cx0) * scale)) - 1, int(round((cy1 - y0) * scale)) - 1)
+    shade = Image.new("RGBA", img.size, (0, 0, 0, 110))
+    if box[2] > box[0] and box[3] > box[1]: ImageDraw.Draw(shade).rectangle(box, fill=(0, 0, 0, 0))
+    img.alpha_composite(shade)
+    return img.rotate(-rotation, expand=True) if rotation else img
+
+# --- HELPER: FULL-TEXT PAGE INDEX ---
+# SQLite FTS5 index of per-page text (PdfReader, same text as "PDF to Text") and word
+# boxes (pdfplumber), keyed by document content hash. A document is marked indexed only
+# after all of its pages are in, so an interrupted run is simply redone next time.
+# Each call opens its own connection: the index object is shared by all sessions.
+def _index_range(pdf_path, first_index, last_index):
+    out = []
+    reader = PdfReader(pdf_path)
+    with pdfplumber.open(pdf_path) as pdf:
+        for i in range(first_index, last_index + 1):
+            try: text = reader.pages[i].extract_text() or ""
+            except Exception: text = ""
+            page = pdf.pages[i]
+            try: words = [[w['text'], round(w['x0'], 2), round(w['top'], 2), round(w['x1'], 2), round(w['bottom'], 2)] for w in page.extract_words()]
+            except Exception: words = []
+            page.close(); out.append((text, words))
+    return out
+
+class PageIndex:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS docs (doc_id TEXT PRIMARY KEY, name TEXT, pages INTEGER, indexed REAL)")
+            db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS page_text USING fts5(doc_id UNINDEXED, page_index UNINDEXED, text)")
+            db.execute("CREATE TABLE IF NOT EXISTS page_words (doc_id TEXT, page_index INTEGER, words TEXT, PRIMARY KEY (doc_id, page_index))")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            with db: yield db
+        finally: db.close()
+
+    def has(self, doc_id):
+        with self._connect() as db:
+            return db.execute("SELECT 1 FROM docs WHERE doc_id = ?", (doc_id,)).fetchone() is not None
+
+    def add(self, pdf_path, doc_id, name=None, max_workers=None, progress=None):
+        if self.has(doc_id): return False
+        with pikepdf.open(pdf_path) as pdf: total = len(pdf.pages)
+        ranges = page_range_tasks(total, max_workers)
+        with self._connect() as db:
+            with db:
+                db.execute("DELETE FROM page_text WHERE doc_id = ?", (doc_id,)); db.execute("DELETE FROM page_words WHERE doc_id = ?", (doc_id,))
+            for done, (n, pages) in enumerate(run_tasks(_index_range, [(pdf_path, first, last) for first, last in ranges], max_workers)):
+                first = ranges[n][0]
+                with db:
+                    db.executemany("INSERT INTO page_text (doc_id, page_index, text) VALUES (?, ?, ?)", [(doc_id, first + k, text) for k, (text, _) in enumerate(pages)])
+                    db.executemany("INSERT OR REPLACE INTO page_words (doc_id, page_index, words) VALUES (?, ?, ?)", [(doc_id, first + k, json.dumps(words)) for k, (_, words) in enumerate(pages)])
+                if progress: progress((done + 1) / len(ranges))
+            db.execute("INSERT OR REPLACE INTO docs (doc_id, name, pages, indexed) VALUES (?, ?, ?, ?)", (doc_id, name, total, time.time()))
+        return True
+
+    def page_texts(self, doc_id):
+        with self._connect() as db:
+            rows = db.execute("SELECT text FROM page_text WHERE doc_id = ? ORDER BY CAST(page_index AS INTEGER)", (doc_id,)).fetchall()
+        return [text for (text,) in rows]
+
+    def page_words(self, doc_id, page_index):
+        with self._connect() as db:
+            row = db.execute("SELECT words FROM page_words WHERE doc_id = ? AND page_index = ?", (doc_id, page_index)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    # Plain words are matched as quoted terms (prefix match on the last one), so user input
+    # never hits FTS5 query syntax. Returns [{'doc_id', 'page_index', 'snippet'}] by rank.
+    def search(self, query, doc_ids=None, limit=200):
+        terms = ['"' + t.replace('"', '""') + '"' for t in query.split()]
+        if not terms: return []
+        terms[-1] += "*"
+        sql = "SELECT doc_id, page_index, snippet(page_text, 2, '**', '**', '…', 12) FROM page_text WHERE page_text MATCH ?"
+        args = [" ".join(terms)]
+        if doc_ids is not None:
+            doc_ids = list(doc_ids)
+            if not doc_ids: return []
+            sql += f" AND doc_id IN ({','.join('?' * len(doc_ids))})"; args += doc_ids
+        sql += " ORDER BY rank LIMIT ?"; args.append(limit)
+        with self._connect() as db:
+            return [{'doc_id': d, 'page_index': int(p), 'snippet': s} for d, p, s in db.execute(sql, args)]
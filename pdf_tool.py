@@ -7,6 +7,7 @@ import math
 import itertools
 import string
 import time
+import functools
 import concurrent.futures
 import xml.etree.ElementTree as ET
 from PIL import Image, ImageDraw, ImageFont
@@ -14,15 +15,15 @@ from pypdf import PdfReader, PdfWriter
 import img2pdf
 from pdf2image import convert_from_bytes
 from pdf2docx import Converter
-import pdfplumber
 import pandas as pd
 import pikepdf
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
-from reportlab.lib.utils import simpleSplit, ImageReader
+from reportlab.lib.utils import simpleSplit
 from reportlab.lib import colors
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
+from pdf_engine import IMAGE_FORMATS, DiskLRUCache, PageIndex, PageStore, ResultStore, ThumbnailRenderer, compress_strong, content_hash, display_size, edit_page_boxes, images_to_zip, iter_page_lines, page_ranges, ocr_missing_text, ocr_pdf, pdf_to_docx_chunked, pdf_to_image_pptx, read_file, read_zip_member, render_page_range, preview_crop, preview_stamp, recompress_images, split_to_zip, stamp_pdf, stamp_text, tables_to_excel, text_to_file
 
 # --- OPTIONAL IMPORTS ---
 try:
@@ -33,7 +34,7 @@ except ImportError:
 
 try:
     from pptx import Presentation
-    from pptx.util import Inches, Pt
+    from pptx.util import Pt
     from pptx.enum.text import PP_ALIGN
     HAS_PPTX_SUPPORT = True
 except ImportError:
@@ -84,7 +85,7 @@ def get_local_tesseract_path():
     return None
 
 # --- HELPER: GENERATE THUMBNAIL ---
-@st.cache_data(show_spinner=False)
+@st.cache_data(show_spinner=False, max_entries=32)
 def get_page_thumbnail(page_bytes, poppler_path=None, width=200):
     try:
         dpi = 72 if width <= 200 else 150
@@ -97,6 +98,131 @@ def get_page_thumbnail(page_bytes, poppler_path=None, width=200):
     except Exception:
         return None
 
+# --- HELPER: PREVIEW BASE ---
+# Page 1 of an upload is parsed and rendered once, from its crop box like 'size'; live
+# previews then only draw the stamp, crop or rotation on top of it.
+def preview_base(file, width=800):
+    cache = st.session_state.setdefault('preview_bases', {}); key = f"{file.name}_{file.size}"
+    if key not in cache:
+        pdf_bytes = file.getvalue()
+        with pikepdf.open(io.BytesIO(pdf_bytes)) as pdf:
+            page = pdf.pages[0]
+            info = {'size': display_size(page), 'cropbox': tuple(float(v) for v in page.cropbox), 'mediabox': tuple(float(v) for v in page.mediabox), 'rotation': int(page.obj.get('/Rotate', 0)) % 360, 'pages': len(pdf.pages)}
+        try: info['image'] = render_page_range(pdf_bytes, 0, 0, poppler_path, width=width, dpi=150, use_cropbox=True)[0]
+        except Exception: info['image'] = None
+        while len(cache) >= 4: cache.pop(next(iter(cache)))
+        cache[key] = info
+    return cache[key]
+
+# --- HELPER: BATCHED GRID THUMBNAILS ---
+# One renderer per poppler path, shared by all sessions (keys are content hashes).
+# Thumbnails persist on disk under THUMB_CACHE_DIR, bounded by THUMB_CACHE_MB (LRU).
+THUMB_CACHE_DIR = os.getenv("VIAPDF_THUMB_CACHE_DIR", os.path.join(os.getcwd(), ".viapdf_cache", "thumbnails"))
+THUMB_CACHE_MB = int(os.getenv("VIAPDF_THUMB_CACHE_MB", "256"))
+
+@st.cache_resource(show_spinner=False)
+def get_thumbnail_renderer(poppler_path=None):
+    return ThumbnailRenderer(poppler_path, cache_dir=THUMB_CACHE_DIR, max_bytes=THUMB_CACHE_MB * 1024 * 1024)
+
+# --- HELPER: OCR RESULT CACHE ---
+# Per-page OCR output shared by all sessions, bounded by OCR_CACHE_MB (LRU).
+OCR_CACHE_DIR = os.getenv("VIAPDF_OCR_CACHE_DIR", os.path.join(os.getcwd(), ".viapdf_cache", "ocr"))
+OCR_CACHE_MB = int(os.getenv("VIAPDF_OCR_CACHE_MB", "512"))
+
+@st.cache_resource(show_spinner=False)
+def get_ocr_cache():
+    return DiskLRUCache(OCR_CACHE_DIR, OCR_CACHE_MB * 1024 * 1024, suffix=".pdf")
+
+# --- HELPER: FULL-TEXT PAGE INDEX ---
+# Per-page text and word boxes of uploaded documents, keyed by content hash and shared by
+# all sessions. Set VIAPDF_INDEX_PATH to an empty value to turn the index off.
+INDEX_PATH = os.getenv("VIAPDF_INDEX_PATH", os.path.join(os.getcwd(), ".viapdf_cache", "page_index.sqlite3"))
+
+@st.cache_resource(show_spinner=False)
+def get_page_index():
+    if not INDEX_PATH: return None
+    try: return PageIndex(INDEX_PATH)
+    except Exception: return None  # e.g. SQLite built without FTS5
+
+def index_upload(pdf_bytes, name, progress=None):
+    index = get_page_index(); doc_id = content_hash(pdf_bytes)
+    if index is None or index.has(doc_id): return doc_id
+    src_path = result_store.new_path(".pdf")
+    with open(src_path, "wb") as f: f.write(pdf_bytes)
+    try: index.add(src_path, doc_id, name=name, progress=progress)
+    finally: os.remove(src_path)
+    return doc_id
+
+def format_page_list(page_indices):
+    return ", ".join(f"{a+1}" if a == b else f"{a+1}-{b+1}" for a, b in page_ranges(page_indices))
+
+def grid_thumbnails(records, width=200):
+    renderer = get_thumbnail_renderer(poppler_path); wanted = {}; thumbs = {}
+    for item in records: wanted.setdefault(item['doc_id'], []).append((item['page_index'], item.get('rotation', 0)))
+    for doc_id, pages in wanted.items():
+        for (idx, rot), img in renderer.thumbnails(doc_id, page_store.docs[doc_id], pages, width).items(): thumbs[(doc_id, idx, rot)] = img
+    return thumbs
+
+# --- HELPER: PAGED PAGE GRID ---
+# Shared organizer grid. Only one view (window) of the queue gets cards, buttons and
+# thumbnails; order and rotation live in the session_state queue, not in widgets.
+def page_grid(queue_key, key_prefix, caption=None, allow_move=True, allow_delete=False, show_rotation=False):
+    queue = st.session_state[queue_key]; total = len(queue)
+    c_size, c_view, c_info = st.columns([1, 1, 2])
+    per_view = c_size.selectbox("Pages per view", [12, 20, 40, 80], index=1, key=f"{key_prefix}_per_view")
+    n_views = max(1, math.ceil(total / per_view)); view_key = f"{key_prefix}_view"
+    if st.session_state.get(view_key, 1) > n_views: st.session_state[view_key] = n_views
+    view = c_view.number_input(f"View (1-{n_views})", min_value=1, max_value=n_views, step=1, key=view_key)
+    start = (view - 1) * per_view; window = queue[start:start + per_view]
+    c_info.caption(f"Showing pages {start + 1}-{start + len(window)} of {total}")
+    thumbs = grid_thumbnails(window)
+    cols = st.columns(4)
+    for j, item in enumerate(window):
+        i = start + j; rot = item.get('rotation', 0)
+        with cols[j % 4]:
+            with st.container():
+                st.markdown(f"<div class='page-card'>", unsafe_allow_html=True)
+                st.caption(caption(i, item) if caption else f"Page {i+1}")
+                thumb = thumbs.get((item['doc_id'], item['page_index'], rot))
+                if thumb: st.image(thumb, use_container_width=True)
+                else: st.info("No Preview")
+                c_rot1, c_rot2 = st.columns(2)
+                if c_rot1.button("⟲", key=f"ccw_{key_prefix}_{item['id']}"): queue[i]['rotation'] = (rot - 90) % 360; st.rerun()
+                if c_rot2.button("⟳", key=f"cw_{key_prefix}_{item['id']}"): queue[i]['rotation'] = (rot + 90) % 360; st.rerun()
+                if allow_move or allow_delete:
+                    if allow_delete: c1, c2, c3 = st.columns([1,1,1])
+                    else: c1, c3 = st.columns(2)
+                    if allow_move and c1.button("⬅️", key=f"L_{key_prefix}_{item['id']}") and i > 0: queue[i], queue[i-1] = queue[i-1], queue[i]; st.rerun()
+                    if allow_delete and c2.button("❌", key=f"D_{key_prefix}_{item['id']}"): queue.pop(i); st.rerun()
+                    if allow_move and c3.button("➡️", key=f"R_{key_prefix}_{item['id']}") and i < total - 1: queue[i], queue[i+1] = queue[i+1], queue[i]; st.rerun()
+                if show_rotation: st.caption(f"Rot: {rot}°")
+                st.markdown("</div>", unsafe_allow_html=True)
+
+# --- HELPER: RESULT DOWNLOAD BUTTON ---
+# Results live on disk in the session's ResultStore; the button reads the file only when clicked.
+def result_download_button(label, handle, file_name=None, **kwargs):
+    return st.download_button(label, result_store.reader(handle), file_name or handle['file_name'], handle['mime'], **kwargs)
+
+# --- HELPER: STAMP UPLOAD ---
+# Watermark, page numbers and header/footer share one engine: each overlay is
+# drawn once and referenced from every page.
+def stamp_upload(file, stamp, file_name):
+    src_path = result_store.new_path(".pdf"); out_path = result_store.new_path(".pdf")
+    with open(src_path, "wb") as f: f.write(file.getvalue())
+    stamp_progress = st.progress(0, text="Stamping pages...")
+    try: stamp_pdf(src_path, out_path, stamp, progress=lambda p: stamp_progress.progress(p, text=f"Stamping pages... {p:.0%}"))
+    finally: os.remove(src_path)
+    return result_store.register(out_path, file_name, "application/pdf")
+
+# --- HELPER: PAGE BOX UPLOAD ---
+# Rotate and Crop only edit page dictionaries; incremental appends them to the original bytes.
+def page_box_upload(file, file_name, incremental=False, rotations=None, crop=None):
+    src_path = result_store.new_path(".pdf"); out_path = result_store.new_path(".pdf")
+    with open(src_path, "wb") as f: f.write(file.getvalue())
+    try: edit_page_boxes(src_path, out_path, rotations=rotations, crop=crop, incremental=incremental)
+    finally: os.remove(src_path)
+    return result_store.register(out_path, file_name, "application/pdf")
+
 # --- HELPER: FONT SELECTOR COMPONENT ---
 def font_selector_component(key_prefix):
     font_options = ["Helvetica", "Helvetica-Bold", "Times-Roman", "Times-Bold", "Courier", "Courier-Bold", "Custom (.ttf)"]
@@ -183,39 +309,23 @@ def parse_order_string(order_str, max_len):
         return None
 
 # --- HELPER: PDF TO EDITABLE PPTX ---
-def create_editable_pptx(pdf_file):
-    prs = Presentation()
-    with pdfplumber.open(pdf_file) as pdf:
-        for page in pdf.pages:
-            pdf_w = page.width
-            pdf_h = page.height
-            slide = prs.slides.add_slide(prs.slide_layouts[6])
-            prs.slide_width = Pt(pdf_w)
-            prs.slide_height = Pt(pdf_h)
-            words = page.extract_words(extra_attrs=["fontname", "size"])
-            lines = {}
-            for w in words:
-                y = round(w['top'], 0) 
-                if y not in lines: lines[y] = []
-                lines[y].append(w)
-            for y in sorted(lines.keys()):
-                line_words = lines[y]
-                line_text = " ".join([w['text'] for w in line_words])
-                x0 = min([w['x0'] for w in line_words])
-                top = min([w['top'] for w in line_words])
-                width = sum([w['x1'] - w['x0'] for w in line_words]) + (len(line_words) * 3) 
-                height = max([w['bottom'] - w['top'] for w in line_words])
-                avg_size = sum([w['size'] for w in line_words]) / len(line_words)
-                txBox = slide.shapes.add_textbox(Pt(x0), Pt(top), Pt(width), Pt(height))
-                tf = txBox.text_frame
-                tf.word_wrap = False 
-                p = tf.paragraphs[0]
-                p.text = line_text
-                p.font.size = Pt(avg_size)
-                p.font.name = "Arial" 
-    out = io.BytesIO()
-    prs.save(out)
-    return out.getvalue()
+# Page layout (line grouping) runs in worker processes; slides are added as pages arrive.
+# A deck has a single slide size, taken from the first page.
+def create_editable_pptx(pdf_path, out_path):
+    prs = Presentation(); blank_slide_layout = prs.slide_layouts[6]
+    for i, (pdf_w, pdf_h, lines) in enumerate(iter_page_lines(pdf_path)):
+        if i == 0: prs.slide_width = Pt(pdf_w); prs.slide_height = Pt(pdf_h)
+        slide = prs.slides.add_slide(blank_slide_layout)
+        for line_text, x0, top, width, height, avg_size in lines:
+            txBox = slide.shapes.add_textbox(Pt(x0), Pt(top), Pt(width), Pt(height))
+            tf = txBox.text_frame
+            tf.word_wrap = False
+            p = tf.paragraphs[0]
+            p.text = line_text
+            p.font.size = Pt(avg_size)
+            p.font.name = "Arial"
+    prs.save(out_path)
+    return out_path
 
 # --- HELPER: THREADED PASSWORD CHECKER ---
 def check_password_batch(filepath, passwords):
@@ -253,12 +363,15 @@ if 'page_queue' not in st.session_state: st.session_state['page_queue'] = []
 if 'processed_files' not in st.session_state: st.session_state['processed_files'] = set()
 if 'extracted_pdf' not in st.session_state: st.session_state['extracted_pdf'] = None
 if 'extracted_preview_imgs' not in st.session_state: st.session_state['extracted_preview_imgs'] = []
-if 'rotate_states' not in st.session_state: st.session_state['rotate_states'] = {} 
+if 'rotate_queue' not in st.session_state: st.session_state['rotate_queue'] = []
 if 'tesseract_path' not in st.session_state: st.session_state['tesseract_path'] = get_local_tesseract_path()
 if 'split_results' not in st.session_state: st.session_state['split_results'] = None
 if 'global_rot_angle' not in st.session_state: st.session_state['global_rot_angle'] = 0
 if 'unlocked_pdf_bytes' not in st.session_state: st.session_state['unlocked_pdf_bytes'] = None
 if 'unlocked_file_data' not in st.session_state: st.session_state['unlocked_file_data'] = None
+if 'search_docs' not in st.session_state: st.session_state['search_docs'] = {}
+if 'search_hits' not in st.session_state: st.session_state['search_hits'] = {}
+if 'search_upload_n' not in st.session_state: st.session_state['search_upload_n'] = 0
 
 # States for Visual Editors
 if 'visual_edit_queue' not in st.session_state: st.session_state['visual_edit_queue'] = []
@@ -266,6 +379,18 @@ if 'visual_edit_file_hash' not in st.session_state: st.session_state['visual_edi
 if 'visual_sign_queue' not in st.session_state: st.session_state['visual_sign_queue'] = []
 if 'visual_sign_file_hash' not in st.session_state: st.session_state['visual_sign_file_hash'] = None
 
+# Shared page store: queues hold (doc_id, page_index, rotation) records, sources are kept once
+if 'page_store' not in st.session_state: st.session_state['page_store'] = PageStore()
+page_store = st.session_state['page_store']
+page_store.prune({item['doc_id'] for q in ('page_queue', 'visual_edit_queue', 'visual_sign_queue', 'rotate_queue') for item in st.session_state[q]} | set(st.session_state['search_docs']))
+
+# Result store: large outputs are written to a per-session temp dir; session_state only keeps handles
+RESULT_TTL_MIN = int(os.getenv("VIAPDF_RESULT_TTL_MIN", "60"))
+RESULT_QUOTA_MB = int(os.getenv("VIAPDF_RESULT_QUOTA_MB", "2048"))
+if 'result_store' not in st.session_state: st.session_state['result_store'] = ResultStore(uuid.uuid4().hex, ttl=RESULT_TTL_MIN * 60, quota=RESULT_QUOTA_MB * 1024 * 1024)
+result_store = st.session_state['result_store']
+result_store.touch()
+
 poppler_path = get_local_poppler_path()
 tesseract_path = get_local_tesseract_path()
 
@@ -282,7 +407,7 @@ category = st.sidebar.selectbox("Choose Category", [
 # CATEGORY 1: ORGANIZE & MERGE
 # ==============================================================================
 if category == "Organize & Merge":
-    tool = st.sidebar.radio("Select Tool", ["Merge & Reorder Pages", "Extract Pages", "Split PDF"])
+    tool = st.sidebar.radio("Select Tool", ["Merge & Reorder Pages", "Extract Pages", "Split PDF", "Search Documents"])
 
     if tool == "Merge & Reorder Pages":
         st.header("🔗 Merge & Organize Pages")
@@ -313,13 +438,8 @@ if category == "Organize & Merge":
                             except: st.error(f"Failed to convert {file.name}")
 
                         if temp_pdf_bytes:
-                            reader = PdfReader(io.BytesIO(temp_pdf_bytes))
-                            for i, page in enumerate(reader.pages):
-                                writer = PdfWriter(); writer.add_page(page); p_bytes = io.BytesIO(); writer.write(p_bytes)
-                                st.session_state['page_queue'].append({
-                                    'id': str(uuid.uuid4()), 'source': file.name, 'page_num': i + 1,
-                                    'bytes': p_bytes.getvalue(), 'rotation': 0
-                                })
+                            doc_id = page_store.add(temp_pdf_bytes)
+                            st.session_state['page_queue'].extend(page_store.records(doc_id, source=file.name))
                             st.session_state['processed_files'].add(file_id)
                             new_files_processed = True
             if new_files_processed: st.rerun()
@@ -339,37 +459,14 @@ if category == "Organize & Merge":
                         if idxs and len(idxs) > 0: st.session_state['page_queue'] = [st.session_state['page_queue'][i] for i in idxs]; st.rerun()
 
             st.write("### Page Preview & Reorder")
-            cols = st.columns(4)
-            for i, item in enumerate(st.session_state['page_queue']):
-                with cols[i % 4]:
-                    with st.container():
-                        st.markdown(f"<div class='page-card'>", unsafe_allow_html=True)
-                        st.caption(f"#{i+1} | {item['source']} (Pg {item['page_num']})")
-                        thumb = get_page_thumbnail(item['bytes'], poppler_path)
-                        rot = item.get('rotation', 0)
-                        if thumb and rot != 0: thumb = thumb.rotate(-rot, expand=True)
-                        if thumb: st.image(thumb, use_container_width=True)
-                        else: st.info("No Preview")
-                        
-                        c_rot1, c_rot2 = st.columns(2)
-                        if c_rot1.button("⟲", key=f"ccw_m_{item['id']}"): st.session_state['page_queue'][i]['rotation'] = (rot - 90) % 360; st.rerun()
-                        if c_rot2.button("⟳", key=f"cw_m_{item['id']}"): st.session_state['page_queue'][i]['rotation'] = (rot + 90) % 360; st.rerun()
-
-                        c1, c2, c3 = st.columns([1,1,1])
-                        if c1.button("⬅️", key=f"L_{item['id']}") and i > 0: st.session_state['page_queue'][i], st.session_state['page_queue'][i-1] = st.session_state['page_queue'][i-1], st.session_state['page_queue'][i]; st.rerun()
-                        if c2.button("❌", key=f"D_{item['id']}"): st.session_state['page_queue'].pop(i); st.rerun()
-                        if c3.button("➡️", key=f"R_{item['id']}") and i < total_pages - 1: st.session_state['page_queue'][i], st.session_state['page_queue'][i+1] = st.session_state['page_queue'][i+1], st.session_state['page_queue'][i]; st.rerun()
-                        st.markdown("</div>", unsafe_allow_html=True)
+            page_grid('page_queue', "m", caption=lambda i, item: f"#{i+1} | {item['source']} (Pg {item['page_num']})", allow_delete=True)
 
             st.markdown("---")
             if st.button("⬇️ Download Final Merged PDF", type="primary"):
-                final_merger = PdfWriter()
-                for item in st.session_state['page_queue']:
-                    r = PdfReader(io.BytesIO(item['bytes'])); page = r.pages[0]
-                    if item.get('rotation', 0) != 0: page.rotate(item['rotation'])
-                    final_merger.add_page(page)
-                out = io.BytesIO(); final_merger.write(out)
-                st.download_button("Click to Save PDF", out.getvalue(), "merged_document.pdf", "application/pdf")
+                merged_path = result_store.new_path(".pdf"); page_store.write(st.session_state['page_queue'], output=merged_path)
+                result_store.discard(st.session_state.get('merged_result'))
+                st.session_state['merged_result'] = result_store.register(merged_path, "merged_document.pdf", "application/pdf")
+                result_download_button("Click to Save PDF", st.session_state['merged_result'])
 
     elif tool == "Extract Pages":
         st.header("📄 Extract Pages")
@@ -382,74 +479,55 @@ if category == "Organize & Merge":
                 file_hash = f"{file.name}_{file.size}"
                 if st.session_state['visual_edit_file_hash'] != file_hash:
                     st.session_state['visual_edit_file_hash'] = file_hash; st.session_state['visual_edit_queue'] = []
-                    file.seek(0); reader = PdfReader(file)
-                    for i, page in enumerate(reader.pages):
-                        writer = PdfWriter(); writer.add_page(page); p_bytes = io.BytesIO(); writer.write(p_bytes)
-                        st.session_state['visual_edit_queue'].append({
-                            'id': str(uuid.uuid4()), 'page_num': i + 1, 'bytes': p_bytes.getvalue(), 'rotation': 0
-                        })
+                    doc_id = page_store.add(file.getvalue())
+                    st.session_state['visual_edit_queue'] = page_store.records(doc_id, source=file.name)
             
                 if st.session_state['visual_edit_queue']:
                     total_pages_source = len(st.session_state['visual_edit_queue'])
                     with st.expander("👁️ Visual Editor", expanded=True):
-                        cols = st.columns(4)
-                        for i, item in enumerate(st.session_state['visual_edit_queue']):
-                            with cols[i % 4]:
-                                with st.container():
-                                    st.markdown(f"<div class='page-card'>", unsafe_allow_html=True)
-                                    st.caption(f"Page {i+1}")
-                                    thumb = get_page_thumbnail(item['bytes'], poppler_path)
-                                    rot = item.get('rotation', 0)
-                                    if thumb and rot != 0: thumb = thumb.rotate(-rot, expand=True)
-                                    if thumb: st.image(thumb, use_container_width=True)
-                                    c_rot1, c_rot2 = st.columns(2)
-                                    if c_rot1.button("⟲", key=f"ccw_e_{item['id']}"): st.session_state['visual_edit_queue'][i]['rotation'] = (rot - 90) % 360; st.rerun()
-                                    if c_rot2.button("⟳", key=f"cw_e_{item['id']}"): st.session_state['visual_edit_queue'][i]['rotation'] = (rot + 90) % 360; st.rerun()
-                                    c1, c2, c3 = st.columns([1,1,1])
-                                    if c1.button("⬅️", key=f"L_e_{item['id']}") and i > 0: st.session_state['visual_edit_queue'][i], st.session_state['visual_edit_queue'][i-1] = st.session_state['visual_edit_queue'][i-1], st.session_state['visual_edit_queue'][i]; st.rerun()
-                                    if c3.button("➡️", key=f"R_e_{item['id']}") and i < total_pages_source - 1: st.session_state['visual_edit_queue'][i], st.session_state['visual_edit_queue'][i+1] = st.session_state['visual_edit_queue'][i+1], st.session_state['visual_edit_queue'][i]; st.rerun()
-                                    st.markdown("</div>", unsafe_allow_html=True)
+                        page_grid('visual_edit_queue', "e")
             else:
                 file.seek(0); reader_check = PdfReader(file); total_pages_source = len(reader_check.pages)
                 
             st.markdown("---")
-            page_input = st.text_input("Pages to Extract (e.g. 1, 3-5)", "1")
+            hit_pages = st.session_state['search_hits'].get(content_hash(file.getvalue()))
+            if hit_pages: st.caption(f"🔎 Prefilled with {len(hit_pages)} pages from your search hits.")
+            page_input = st.text_input("Pages to Extract (e.g. 1, 3-5)", format_page_list(hit_pages) if hit_pages else "1")
             if st.button("Preview & Process"):
                 try:
                     idxs = parse_order_string(page_input, total_pages_source)
                     if idxs:
                         writer = PdfWriter(); preview_imgs = []
                         if use_visual:
-                             for i, page_idx in enumerate(idxs):
-                                item = st.session_state['visual_edit_queue'][page_idx]
-                                p_reader = PdfReader(io.BytesIO(item['bytes'])); page = p_reader.pages[0]
-                                if item.get('rotation', 0) != 0: page.rotate(item['rotation'])
-                                writer.add_page(page)
-                                if poppler_path:
-                                    temp_writer = PdfWriter(); temp_writer.add_page(page); temp_bytes = io.BytesIO(); temp_writer.write(temp_bytes)
-                                    thumb = get_page_thumbnail(temp_bytes.getvalue(), poppler_path)
-                                    if thumb: preview_imgs.append((i+1, thumb))
+                             selected = [st.session_state['visual_edit_queue'][page_idx] for page_idx in idxs]
+                             thumbs = grid_thumbnails(selected) if poppler_path else {}
+                             for i, item in enumerate(selected):
+                                page_store.add_to_writer(writer, item)
+                                thumb = thumbs.get((item['doc_id'], item['page_index'], item.get('rotation', 0)))
+                                if thumb: preview_imgs.append((i+1, thumb))
                         else:
                             file.seek(0); reader = PdfReader(file)
+                            thumbs = {}
+                            if poppler_path:
+                                 doc_bytes = file.getvalue(); thumbs = get_thumbnail_renderer(poppler_path).thumbnails(content_hash(doc_bytes), doc_bytes, [(i, 0) for i in idxs])
                             for i, page_idx in enumerate(idxs):
-                                page = reader.pages[page_idx]; writer.add_page(page)
-                                if poppler_path:
-                                     temp_writer = PdfWriter(); temp_writer.add_page(page); temp_bytes = io.BytesIO(); temp_writer.write(temp_bytes)
-                                     thumb = get_page_thumbnail(temp_bytes.getvalue(), poppler_path)
-                                     if thumb: preview_imgs.append((i+1, thumb))
-                        out = io.BytesIO(); writer.write(out)
-                        st.session_state['extracted_pdf'] = out.getvalue()
+                                writer.add_page(reader.pages[page_idx])
+                                if thumbs.get((page_idx, 0)): preview_imgs.append((i+1, thumbs[(page_idx, 0)]))
+                        extracted_path = result_store.new_path(".pdf")
+                        with open(extracted_path, "wb") as f: writer.write(f)
+                        result_store.discard(st.session_state['extracted_pdf'])
+                        st.session_state['extracted_pdf'] = result_store.register(extracted_path, "extracted.pdf", "application/pdf")
                         st.session_state['extracted_preview_imgs'] = preview_imgs
                     else: st.error("No valid pages selected.")
                 except Exception as e: st.error(f"Error processing pages: {e}")
 
-            if st.session_state.get('extracted_pdf'):
+            if result_store.exists(st.session_state.get('extracted_pdf')):
                 st.markdown("### Result Preview")
                 if st.session_state['extracted_preview_imgs']:
                     cols = st.columns(4)
                     for i, (num, img) in enumerate(st.session_state['extracted_preview_imgs']):
                         with cols[i % 4]: st.image(img, caption=f"New Page {num}", use_container_width=True)
-                st.download_button(label="⬇️ Download Extracted PDF", data=st.session_state['extracted_pdf'], file_name="extracted.pdf", mime="application/pdf", type="primary")
+                result_download_button("⬇️ Download Extracted PDF", st.session_state['extracted_pdf'], type="primary")
 
     elif tool == "Split PDF":
         st.header("✂️ Split PDF")
@@ -462,33 +540,13 @@ if category == "Organize & Merge":
                 file_hash = f"{file.name}_{file.size}"
                 if st.session_state['visual_edit_file_hash'] != file_hash:
                     st.session_state['visual_edit_file_hash'] = file_hash; st.session_state['visual_edit_queue'] = []
-                    file.seek(0); reader = PdfReader(file)
-                    for i, page in enumerate(reader.pages):
-                        writer = PdfWriter(); writer.add_page(page); p_bytes = io.BytesIO(); writer.write(p_bytes)
-                        st.session_state['visual_edit_queue'].append({
-                            'id': str(uuid.uuid4()), 'page_num': i + 1, 'bytes': p_bytes.getvalue(), 'rotation': 0
-                        })
+                    doc_id = page_store.add(file.getvalue())
+                    st.session_state['visual_edit_queue'] = page_store.records(doc_id, source=file.name)
                 
                 if st.session_state['visual_edit_queue']:
                     total_pages_source = len(st.session_state['visual_edit_queue'])
                     with st.expander("👁️ Visual Editor", expanded=True):
-                        cols = st.columns(4)
-                        for i, item in enumerate(st.session_state['visual_edit_queue']):
-                            with cols[i % 4]:
-                                with st.container():
-                                    st.markdown(f"<div class='page-card'>", unsafe_allow_html=True)
-                                    st.caption(f"Page {i+1}")
-                                    thumb = get_page_thumbnail(item['bytes'], poppler_path)
-                                    rot = item.get('rotation', 0)
-                                    if thumb and rot != 0: thumb = thumb.rotate(-rot, expand=True)
-                                    if thumb: st.image(thumb, use_container_width=True)
-                                    c_rot1, c_rot2 = st.columns(2)
-                                    if c_rot1.button("⟲", key=f"ccw_s_{item['id']}"): st.session_state['visual_edit_queue'][i]['rotation'] = (rot - 90) % 360; st.rerun()
-                                    if c_rot2.button("⟳", key=f"cw_s_{item['id']}"): st.session_state['visual_edit_queue'][i]['rotation'] = (rot + 90) % 360; st.rerun()
-                                    c1, c2, c3 = st.columns([1,1,1])
-                                    if c1.button("⬅️", key=f"L_s_{item['id']}") and i > 0: st.session_state['visual_edit_queue'][i], st.session_state['visual_edit_queue'][i-1] = st.session_state['visual_edit_queue'][i-1], st.session_state['visual_edit_queue'][i]; st.rerun()
-                                    if c3.button("➡️", key=f"R_s_{item['id']}") and i < total_pages_source - 1: st.session_state['visual_edit_queue'][i], st.session_state['visual_edit_queue'][i+1] = st.session_state['visual_edit_queue'][i+1], st.session_state['visual_edit_queue'][i]; st.rerun()
-                                    st.markdown("</div>", unsafe_allow_html=True)
+                        page_grid('visual_edit_queue', "s")
             else:
                 file.seek(0); reader = PdfReader(file); total_pages_source = len(reader.pages)
             
@@ -496,7 +554,9 @@ if category == "Organize & Merge":
             split_groups = []
             
             if mode == "Custom Ranges":
-                range_str = st.text_input("Ranges (comma separated)", "1-5, 6-10") 
+                hit_pages = st.session_state['search_hits'].get(content_hash(file.getvalue()))
+                if hit_pages: st.caption(f"🔎 Prefilled with the {len(hit_pages)} pages from your search hits.")
+                range_str = st.text_input("Ranges (comma separated)", format_page_list(hit_pages) if hit_pages else "1-5, 6-10")
                 if range_str:
                     try:
                         parts = [p.strip() for p in range_str.split(',') if p.strip()]
@@ -517,35 +577,90 @@ if category == "Organize & Merge":
             if st.button("Process Split", type="primary"):
                 if not split_groups: st.error("No ranges defined.")
                 else:
+                    work_dir = None
                     try:
-                        files_data = []; zip_buffer = io.BytesIO()
-                        with zipfile.ZipFile(zip_buffer, "w") as zf:
-                            for idx, pages in enumerate(split_groups):
-                                writer = PdfWriter(); valid = False
-                                for p_idx in pages:
-                                    if 0 <= p_idx < total_pages_source:
-                                        page = None
-                                        if use_visual:
-                                             item = st.session_state['visual_edit_queue'][p_idx]
-                                             p_reader = PdfReader(io.BytesIO(item['bytes'])); page = p_reader.pages[0]
-                                             if item.get('rotation', 0) != 0: page.rotate(item['rotation'])
-                                        else:
-                                             file.seek(0); safe_reader = PdfReader(file); page = safe_reader.pages[p_idx]
-                                        writer.add_page(page); valid = True
-                                if valid:
-                                    pdf_bytes = io.BytesIO(); writer.write(pdf_bytes); data = pdf_bytes.getvalue()
-                                    if len(pages) == 1: name = f"Page_{pages[0]+1}.pdf"
-                                    else: name = f"Split_{idx+1}_(Pg{pages[0]+1}-{pages[-1]+1}).pdf"
-                                    zf.writestr(name, data); files_data.append((name, data))
-                        st.session_state['split_results'] = {'zip': zip_buffer.getvalue(), 'files': files_data}
+                        groups = []
+                        for idx, pages in enumerate(split_groups):
+                            valid = [p_idx for p_idx in pages if 0 <= p_idx < total_pages_source]
+                            if not valid: continue
+                            if use_visual: page_refs = [(st.session_state['visual_edit_queue'][p_idx]['page_index'], st.session_state['visual_edit_queue'][p_idx].get('rotation', 0)) for p_idx in valid]
+                            else: page_refs = [(p_idx, 0) for p_idx in valid]
+                            if len(pages) == 1: name = f"Page_{pages[0]+1}.pdf"
+                            else: name = f"Split_{idx+1}_(Pg{pages[0]+1}-{pages[-1]+1}).pdf"
+                            groups.append((name, page_refs))
+                        src_bytes = page_store.docs[st.session_state['visual_edit_queue'][0]['doc_id']] if use_visual else file.getvalue()
+                        work_dir = result_store.new_dir(); src_path = os.path.join(work_dir, "source.pdf"); zip_path = os.path.join(work_dir, "split_files.zip")
+                        with open(src_path, "wb") as f: f.write(src_bytes)
+                        split_progress = st.progress(0, text=f"Writing {len(groups)} files...")
+                        files = split_to_zip(src_path, groups, zip_path, work_dir, progress=split_progress.progress)
+                        os.remove(src_path)
+                        if st.session_state['split_results']: result_store.discard(st.session_state['split_results']['dir'])
+                        st.session_state['split_results'] = {'dir': result_store.register(work_dir), 'zip': zip_path, 'files': files}
                     except Exception as e: st.error(f"Error splitting PDF: {e}")
+                    finally: result_store.cleanup(work_dir)
 
-            if st.session_state['split_results']:
+            if st.session_state['split_results'] and result_store.exists(st.session_state['split_results']['dir']):
                 st.success("Split Complete!")
                 res = st.session_state['split_results']
-                st.download_button("⬇️ Download All (ZIP)", res['zip'], "split_files.zip", "application/zip", type="primary")
+                st.download_button("⬇️ Download All (ZIP)", functools.partial(read_file, res['zip']), "split_files.zip", "application/zip", type="primary")
                 st.markdown("### Individual Downloads")
-                for name, data in res['files']: st.download_button(f"📄 {name}", data, name, "application/pdf")
+                pick = st.selectbox(f"File ({len(res['files'])} total)", range(len(res['files'])), format_func=lambda i: res['files'][i][0])
+                name, path = res['files'][pick]
+                st.download_button(f"📄 {name}", functools.partial(read_file, path), name, "application/pdf")
+
+    elif tool == "Search Documents":
+        st.header("🔎 Search Documents")
+        index = get_page_index()
+        if index is None: st.error("⚠️ The full-text index is unavailable (SQLite without FTS5, or VIAPDF_INDEX_PATH is empty).")
+        else:
+            st.write("Upload PDFs to search their text. Pages are indexed once on this machine; re-uploading a document skips extraction.")
+            uploaded_files = st.file_uploader("Add PDFs", type="pdf", accept_multiple_files=True, key=f"search_upload_{st.session_state['search_upload_n']}")
+            for file in uploaded_files or []:
+                pdf_bytes = file.getvalue(); doc_id = content_hash(pdf_bytes)
+                if doc_id in st.session_state['search_docs']: continue
+                try:
+                    if not index.has(doc_id):
+                        index_progress = st.progress(0, text=f"Indexing {file.name}...")
+                        index_upload(pdf_bytes, file.name, progress=lambda p: index_progress.progress(p, text=f"Indexing {file.name}... {p:.0%}"))
+                        index_progress.empty()
+                    page_store.add(pdf_bytes); st.session_state['search_docs'][doc_id] = file.name
+                except Exception as e: st.error(f"Failed to index {file.name}: {e}")
+
+            docs = st.session_state['search_docs']
+            if docs:
+                c_info, c_clear = st.columns([4, 1]); c_info.info(f"Searching {len(docs)} document(s): {', '.join(docs.values())}")
+                # A new uploader key drops the uploaded files too, so they are not indexed back in on the rerun.
+                if c_clear.button("Clear All"): st.session_state['search_upload_n'] += 1; st.session_state['search_docs'] = {}; st.session_state['search_hits'] = {}; st.rerun()
+                query = st.text_input("Search text", key="search_query")
+                if query:
+                    start = time.perf_counter(); hits = index.search(query, doc_ids=docs); elapsed = time.perf_counter() - start
+                    st.caption(f"{len(hits)} matching pages in {elapsed * 1000:.0f} ms")
+                    if hits:
+                        shown = hits[:20]
+                        thumbs = grid_thumbnails([{'doc_id': h['doc_id'], 'page_index': h['page_index']} for h in shown])
+                        cols = st.columns(4)
+                        for j, hit in enumerate(shown):
+                            with cols[j % 4]:
+                                st.caption(f"{docs[hit['doc_id']]} (Pg {hit['page_index'] + 1})")
+                                thumb = thumbs.get((hit['doc_id'], hit['page_index'], 0))
+                                if thumb: st.image(thumb, use_container_width=True)
+                                else: st.info("No Preview")
+                                st.markdown(hit['snippet'])
+                        if len(hits) > len(shown): st.caption(f"Showing the top {len(shown)} of {len(hits)} pages.")
+
+                        hit_pages = {}
+                        for hit in hits: hit_pages.setdefault(hit['doc_id'], []).append(hit['page_index'])
+                        hit_pages = {doc_id: sorted(pages) for doc_id, pages in hit_pages.items()}
+                        st.markdown("---"); c_send, c_extract = st.columns(2)
+                        if c_send.button("Send Hits to Extract Pages & Split"):
+                            st.session_state['search_hits'] = hit_pages
+                            st.success("Done! Upload the same file in Extract Pages or Split PDF and the matching pages are prefilled.")
+                        if c_extract.button("Extract Matching Pages", type="primary"):
+                            records = [{'doc_id': doc_id, 'page_index': i, 'rotation': 0} for doc_id in docs if doc_id in hit_pages for i in hit_pages[doc_id]]
+                            out_path = result_store.new_path(".pdf"); page_store.write(records, output=out_path)
+                            result_store.discard(st.session_state.get('search_result'))
+                            st.session_state['search_result'] = result_store.register(out_path, "search_results.pdf", "application/pdf")
+                        if result_store.exists(st.session_state.get('search_result')): result_download_button("⬇️ Download Matching Pages", st.session_state['search_result'])
 
 # ==============================================================================
 # CATEGORY 2: OPTIMIZE & REPAIR
@@ -558,9 +673,12 @@ elif category == "Optimize & Repair":
         st.header("📉 Compress PDF")
         file = st.file_uploader("Upload PDF", type="pdf")
         if file: file.seek(0, os.SEEK_END); orig_size = file.tell(); file.seek(0); st.info(f"Original File Size: {orig_size/1024:.2f} KB")
-        comp_mode = st.radio("Compression Level", ["Basic (Lossless)", "Strong (Flatten to Images)"])
-        quality_val = 70
+        comp_mode = st.radio("Compression Level", ["Basic (Lossless)", "Smart (Recompress Images, Keep Text)", "Strong (Flatten to Images)"])
+        quality_val = 70; max_dpi = 150
         if "Strong" in comp_mode: quality_val = st.slider("Compression Strength (Image Quality)", min_value=10, max_value=95, value=60)
+        if "Smart" in comp_mode:
+            c1, c2 = st.columns(2)
+            quality_val = c1.slider("Image Quality", min_value=10, max_value=95, value=70); max_dpi = c2.slider("Max Image DPI", min_value=72, max_value=300, value=150)
         if file and st.button("Compress"):
             file.seek(0)
             if comp_mode.startswith("Basic"):
@@ -572,19 +690,31 @@ elif category == "Optimize & Repair":
                     with open("temp_out.pdf", "rb") as f: st.download_button("Download Compressed PDF", f.read(), "compressed_lossless.pdf", "application/pdf")
                     os.remove("temp_in.pdf"); os.remove("temp_out.pdf")
                 except Exception as e: st.error(f"Error: {e}")
+            elif comp_mode.startswith("Smart"):
+                src_path = result_store.new_path(".pdf"); out_path = result_store.new_path(".pdf")
+                try:
+                    with open(src_path, "wb") as f: f.write(file.read())
+                    comp_progress = st.progress(0)
+                    stats = recompress_images(src_path, out_path, max_dpi=max_dpi, quality=quality_val, progress=comp_progress.progress)
+                    comp_progress.progress(1.0)
+                    handle = result_store.register(out_path, "compressed_smart.pdf", "application/pdf")
+                    st.success(f"Done! New Size: {handle['size']/1024:.2f} KB")
+                    st.caption(f"{stats['images']} images found, {stats['recompressed']} recompressed, {stats['deduplicated']} duplicate references merged. Text and vector content untouched.")
+                    result_download_button("Download Compressed PDF", handle)
+                except Exception as e: st.error(f"Error: {e}")
+                finally: result_store.cleanup(src_path, out_path)
             else:
                 st.info(f"Converting pages to images ({quality_val}% Quality JPEG) and rebuilding PDF...")
+                src_path = result_store.new_path(".pdf"); out_path = result_store.new_path(".pdf")
                 try:
-                    common_args = {"dpi": 150}
-                    if poppler_path: images = convert_from_bytes(file.read(), poppler_path=poppler_path, **common_args)
-                    else: images = convert_from_bytes(file.read(), **common_args)
-                    img_bytes_list = []
-                    for img in images: b = io.BytesIO(); img.save(b, format='JPEG', quality=quality_val); img_bytes_list.append(b.getvalue())
-                    pdf_bytes = img2pdf.convert(img_bytes_list)
-                    new_size = len(pdf_bytes)
-                    st.success(f"Done! New Size: {new_size/1024:.2f} KB")
-                    st.download_button("Download Compressed PDF", pdf_bytes, "compressed_strong.pdf", "application/pdf")
+                    with open(src_path, "wb") as f: f.write(file.read())
+                    comp_progress = st.progress(0)
+                    compress_strong(src_path, out_path, dpi=150, quality=quality_val, poppler_path=poppler_path, progress=comp_progress.progress)
+                    handle = result_store.register(out_path, "compressed_strong.pdf", "application/pdf")
+                    st.success(f"Done! New Size: {handle['size']/1024:.2f} KB")
+                    result_download_button("Download Compressed PDF", handle)
                 except Exception as e: st.error(f"Error: {e}")
+                finally: result_store.cleanup(src_path, out_path)
 
     # --- 2. REPAIR PDF ---
     elif tool == "Repair PDF":
@@ -609,65 +739,97 @@ elif category == "Convert FROM PDF":
     if tool == "PDF to Images":
         st.header("🖼️ PDF to Images")
         file = st.file_uploader("Upload PDF", type="pdf")
-        col_set, _ = st.columns([2,1])
+        col_set, col_fmt, col_gray = st.columns([2, 1, 1])
         with col_set: quality_setting = st.select_slider("Conversion Speed vs Quality", options=["Screen (72 dpi)", "Standard (150 dpi)", "Print (300 dpi)"], value="Standard (150 dpi)")
+        with col_fmt: image_format = st.selectbox("Format", list(IMAGE_FORMATS))
+        with col_gray: grayscale = st.checkbox("Grayscale")
         dpi_map = {"Screen (72 dpi)": 72, "Standard (150 dpi)": 150, "Print (300 dpi)": 300}; selected_dpi = dpi_map[quality_setting]
         if file and st.button("Convert to Images"):
-            common_args = {"dpi": selected_dpi, "thread_count": 4}
-            if poppler_path: images = convert_from_bytes(file.read(), poppler_path=poppler_path, **common_args)
-            else: images = convert_from_bytes(file.read(), **common_args)
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, "w") as zf:
-                for i, img in enumerate(images):
-                    c1, c2 = st.columns([1,3])
-                    with c1: st.image(img, use_container_width=True)
-                    b = io.BytesIO(); img.save(b, 'JPEG'); img_bytes = b.getvalue()
-                    zf.writestr(f"page_{i+1}.jpg", img_bytes)
-                    with c2: st.download_button(f"Download Page {i+1}", img_bytes, f"p{i+1}.jpg", "image/jpeg")
+            src_path = result_store.new_path(".pdf"); work_dir = result_store.new_dir(); zip_path = os.path.join(work_dir, "all_images.zip")
+            try:
+                with open(src_path, "wb") as f: f.write(file.read())
+                image_progress = st.progress(0, text="Converting pages...")
+                names, previews = images_to_zip(src_path, zip_path, dpi=selected_dpi, fmt=image_format, grayscale=grayscale, poppler_path=poppler_path, progress=lambda p: image_progress.progress(p, text=f"Converting pages... {p:.0%}"))
+                if st.session_state.get('image_results'): result_store.discard(st.session_state['image_results']['dir'])
+                st.session_state['image_results'] = {'dir': result_store.register(work_dir), 'zip': zip_path, 'names': names, 'previews': previews, 'mime': IMAGE_FORMATS[image_format][1]}
+            except Exception as e: st.error(f"Error: {e}")
+            finally: result_store.cleanup(src_path, work_dir)
+
+        res = st.session_state.get('image_results')
+        if res and result_store.exists(res['dir']):
+            st.success(f"Converted {len(res['names'])} pages.")
+            cols = st.columns(4)
+            for i, img in enumerate(res['previews']):
+                with cols[i % 4]: st.image(img, caption=f"Page {i+1}", use_container_width=True)
+            if len(res['names']) > len(res['previews']): st.caption(f"Previewing the first {len(res['previews'])} pages.")
             st.markdown("---")
-            st.download_button(label="⬇️ Download All (ZIP)", data=zip_buffer.getvalue(), file_name="all_images.zip", mime="application/zip", type="primary")
+            st.download_button(label="⬇️ Download All (ZIP)", data=functools.partial(read_file, res['zip']), file_name="all_images.zip", mime="application/zip", type="primary")
+            pick = st.selectbox(f"Single page ({len(res['names'])} total)", range(len(res['names'])), format_func=lambda i: f"Page {i+1}")
+            name = res['names'][pick]
+            st.download_button(f"Download Page {pick+1}", functools.partial(read_zip_member, res['zip'], name), name, res['mime'])
 
     elif tool == "PDF to Word":
         st.header("📝 PDF to Word (.docx)")
         file = st.file_uploader("Upload PDF", type="pdf")
+        word_mode = st.radio("Conversion Mode", ["Standard", "Parallel (Page Chunks)"], horizontal=True, help="Parallel mode converts page chunks in separate processes and joins them into one document.")
+        chunk_pages = st.number_input("Pages per chunk", min_value=1, max_value=100, value=10) if word_mode.startswith("Parallel") else None
         if file and st.button("Convert to Word"):
+            temp_pdf = result_store.new_path(".pdf"); temp_docx = result_store.new_path(".docx")
             try:
-                temp_pdf = f"temp_{uuid.uuid4()}.pdf"; temp_docx = f"temp_{uuid.uuid4()}.docx"
                 with open(temp_pdf, "wb") as f: f.write(file.read())
-                cv = Converter(temp_pdf); cv.convert(temp_docx, start=0, end=None); cv.close()
-                with open(temp_docx, "rb") as f: docx_bytes = f.read()
-                st.success("Success!"); st.download_button("Download Word Doc", docx_bytes, "converted.docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", type="primary")
-                os.remove(temp_pdf); os.remove(temp_docx)
+                if chunk_pages:
+                    # Any widget interaction (e.g. Cancel) reruns the script, which stops this loop at the
+                    # next progress update (the next finished chunk); queued chunks are dropped and
+                    # the ones still converting are terminated.
+                    st.button("Cancel Conversion")
+                    word_progress = st.progress(0, text="Converting...")
+                    pdf_to_docx_chunked(temp_pdf, temp_docx, chunk_pages=int(chunk_pages), progress=lambda done, n, start, end: word_progress.progress(done / n, text=f"Converted chunk {done}/{n} (pages {start + 1}-{end})"))
+                else:
+                    cv = Converter(temp_pdf); cv.convert(temp_docx, start=0, end=None); cv.close()
+                handle = result_store.register(temp_docx, "converted.docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+                st.success("Success!"); result_download_button("Download Word Doc", handle, type="primary")
             except Exception as e: st.error(f"Error: {e}")
+            # Cancel stops the script with a rerun exception, which only this finally sees.
+            finally: result_store.cleanup(temp_pdf, temp_docx)
 
     elif tool == "PDF to Excel":
         st.header("📊 PDF to Excel (.xlsx)")
         file = st.file_uploader("Upload PDF", type="pdf")
+        force_full = st.checkbox("Force full scan", help="By default, pages without ruling lines are skipped because they cannot contain a detectable table. Tick to run table detection on every page.")
         if file and st.button("Convert to Excel"):
+            src_path = result_store.new_path(".pdf"); out_path = result_store.new_path(".xlsx")
             try:
-                all_tables = []
-                with pdfplumber.open(file) as pdf:
-                    for i, page in enumerate(pdf.pages):
-                        tables = page.extract_tables()
-                        for table in tables: df = pd.DataFrame(table); all_tables.append(df)
-                if all_tables:
-                    output = io.BytesIO()
-                    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                        for i, df in enumerate(all_tables): df.to_excel(writer, sheet_name=f"Table_{i+1}", index=False, header=False)
-                    st.success(f"Found {len(all_tables)} tables!"); st.download_button("Download Excel File", output.getvalue(), "extracted_tables.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", type="primary")
+                with open(src_path, "wb") as f: f.write(file.read())
+                table_progress = st.progress(0, text="Extracting tables...")
+                report = tables_to_excel(src_path, out_path, prefilter=not force_full, progress=lambda p: table_progress.progress(p, text=f"Extracting tables... {p:.0%}"))
+                if not force_full:
+                    saved = f"~{report['saved_seconds']:.1f}s saved" if report['saved_seconds'] is not None else "no time estimate"
+                    st.caption(f"Pre-filter skipped {report['skipped']} of {report['pages']} pages without table structure ({saved}).")
+                if report['tables']:
+                    handle = result_store.register(out_path, "extracted_tables.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                    st.success(f"Found {report['tables']} tables!"); result_download_button("Download Excel File", handle, type="primary")
                 else: st.warning("No tables found.")
             except Exception as e: st.error(f"Error: {e}")
+            finally: result_store.cleanup(src_path, out_path)
 
     elif tool == "PDF to Text":
         st.header("📄 PDF to Text (.txt)")
         file = st.file_uploader("Upload PDF", type="pdf")
         if file and st.button("Extract Text"):
+            src_path = result_store.new_path(".pdf"); out_path = result_store.new_path(".txt")
             try:
-                reader = PdfReader(file); full_text = ""
-                for page in reader.pages: full_text += page.extract_text() + "\n\n"
-                st.success("Done!"); st.text_area("Preview", full_text[:500] + "...", height=200)
-                st.download_button("Download Text File", full_text, "extracted_text.txt", "text/plain", type="primary")
+                pdf_bytes = file.getvalue(); index = get_page_index(); doc_id = content_hash(pdf_bytes)
+                # Documents already in the page index are written straight from it.
+                texts = index.page_texts(doc_id) if index is not None and index.has(doc_id) else None
+                if texts is None:
+                    with open(src_path, "wb") as f: f.write(pdf_bytes)
+                else: st.caption("🔎 Document found in the page index; extraction skipped.")
+                text_progress = st.progress(0, text="Extracting text..."); preview_slot = st.empty()
+                text_to_file(src_path, out_path, preview=lambda head: preview_slot.text_area("Preview", head + "...", height=200), progress=lambda p: text_progress.progress(p, text=f"Extracting text... {p:.0%}"), texts=texts)
+                handle = result_store.register(out_path, "extracted_text.txt", "text/plain")
+                st.success("Done!"); result_download_button("Download Text File", handle, type="primary")
             except Exception as e: st.error(f"Error: {e}")
+            finally: result_store.cleanup(src_path, out_path)
 
     elif tool == "PDF to PowerPoint":
         st.header("📽️ PDF to PowerPoint (.pptx)")
@@ -678,22 +840,25 @@ elif category == "Convert FROM PDF":
             if file and st.button("Convert to PPTX"):
                 try:
                     if mode.startswith("Editable"):
-                        with st.spinner("Analyzing text layout (Editable Mode)..."):
-                            pptx_bytes = create_editable_pptx(file)
-                            st.success("Editable Conversion Complete!")
-                            st.download_button("⬇️ Download PPTX", pptx_bytes, "editable_presentation.pptx", "application/vnd.openxmlformats-officedocument.presentationml.presentation", type="primary")
+                        src_path = result_store.new_path(".pdf"); out_path = result_store.new_path(".pptx")
+                        try:
+                            with st.spinner("Analyzing text layout (Editable Mode)..."):
+                                with open(src_path, "wb") as f: f.write(file.read())
+                                create_editable_pptx(src_path, out_path)
+                                handle = result_store.register(out_path, "editable_presentation.pptx", "application/vnd.openxmlformats-officedocument.presentationml.presentation")
+                                st.success("Editable Conversion Complete!")
+                                result_download_button("⬇️ Download PPTX", handle, type="primary")
+                        finally: result_store.cleanup(src_path, out_path)
                     else:
-                        with st.spinner("Converting pages to slides (Image Mode)..."):
-                            images = convert_from_bytes(file.read(), poppler_path=poppler_path, dpi=150)
-                            prs = Presentation(); blank_slide_layout = prs.slide_layouts[6]
-                            if images:
-                                width_px, height_px = images[0].size; aspect_ratio = width_px / height_px
-                                prs.slide_width = Inches(10); prs.slide_height = Inches(10 / aspect_ratio)
-                            for img in images:
-                                slide = prs.slides.add_slide(blank_slide_layout); img_stream = io.BytesIO(); img.save(img_stream, format="PNG"); slide.shapes.add_picture(img_stream, 0, 0, width=prs.slide_width, height=prs.slide_height)
-                            pptx_out = io.BytesIO(); prs.save(pptx_out)
+                        src_path = result_store.new_path(".pdf"); out_path = result_store.new_path(".pptx")
+                        try:
+                            with open(src_path, "wb") as f: f.write(file.read())
+                            slide_progress = st.progress(0, text="Converting pages to slides (Image Mode)...")
+                            pdf_to_image_pptx(src_path, out_path, dpi=150, poppler_path=poppler_path, progress=lambda p: slide_progress.progress(p, text=f"Converting pages to slides (Image Mode)... {p:.0%}"))
+                            handle = result_store.register(out_path, "presentation_images.pptx", "application/vnd.openxmlformats-officedocument.presentationml.presentation")
                             st.success("Image Conversion Complete!")
-                            st.download_button("⬇️ Download PPTX", pptx_out.getvalue(), "presentation_images.pptx", "application/vnd.openxmlformats-officedocument.presentationml.presentation", type="primary")
+                            result_download_button("⬇️ Download PPTX", handle, type="primary")
+                        finally: result_store.cleanup(src_path, out_path)
                 except Exception as e: st.error(f"Error converting to PowerPoint: {e}")
 
     elif tool == "OCR PDF (Searchable)":
@@ -707,27 +872,25 @@ elif category == "Convert FROM PDF":
             if st.session_state.get('tesseract_path') and os.path.exists(st.session_state['tesseract_path']):
                 file = st.file_uploader("Upload Scanned PDF or Image", type=["pdf", "png", "jpg", "jpeg"])
                 lang = st.selectbox("Language", ["eng", "spa", "fra", "deu"])
+                ocr_mode = st.radio("OCR Mode", ["All Pages", "Skip Pages That Already Have Text"], horizontal=True, help="Born-digital pages are kept as-is; only image-only pages get an invisible OCR text layer.") if file and file.name.lower().endswith(".pdf") else "All Pages"
                 if file and st.button("Run OCR", type="primary"):
+                    src_path = result_store.new_path(os.path.splitext(file.name)[1].lower()); out_path = result_store.new_path(".pdf")
                     try:
-                        def process_ocr_page(image):
-                            return pytesseract.image_to_pdf_or_hocr(image, extension='pdf', lang=lang)
-
-                        with st.spinner("Running OCR in parallel..."):
-                            if file.name.endswith(".pdf"): images = convert_from_bytes(file.read(), poppler_path=poppler_path, dpi=200)
-                            else: images = [Image.open(file)]
-                            
-                            pdf_writer = PdfWriter()
-                            # Use ThreadPoolExecutor to process pages concurrently
-                            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-                                results = list(executor.map(process_ocr_page, images))
-                            
-                            for page_bytes in results:
-                                pdf_reader = PdfReader(io.BytesIO(page_bytes))
-                                pdf_writer.add_page(pdf_reader.pages[0])
-                                
-                            out = io.BytesIO(); pdf_writer.write(out)
-                            st.success(f"OCR Complete! Processed {len(images)} pages."); st.download_button("Download Searchable PDF", out.getvalue(), "ocr_searchable.pdf", "application/pdf")
+                        with open(src_path, "wb") as f: f.write(file.read())
+                        ocr_progress = st.progress(0, text="Running OCR...")
+                        ocr_args = dict(lang=lang, dpi=200, tesseract_cmd=st.session_state['tesseract_path'], poppler_path=poppler_path, cache=get_ocr_cache(), progress=lambda p: ocr_progress.progress(p, text=f"Running OCR... {p:.0%}"))
+                        skip_mode = ocr_mode.startswith("Skip")
+                        report = ocr_missing_text(src_path, out_path, **ocr_args) if skip_mode else ocr_pdf(src_path, out_path, **ocr_args)
+                        ocr_progress.progress(1.0, text="OCR finished.")
+                        handle = result_store.register(out_path, "ocr_searchable.pdf", "application/pdf")
+                        st.success(f"OCR Complete! Processed {report['ocr_pages']} pages.")
+                        st.caption(f"OCR cache: {report['cache_hits']} hits, {report['cache_misses']} misses.")
+                        if skip_mode:
+                            saved = f"~{report['saved_seconds']:.1f}s saved" if report['saved_seconds'] is not None else "no OCR needed"
+                            st.info(f"Skipped {report['skipped']} of {report['pages']} pages that already had text or were blank ({saved}; text check took {report['scan_seconds']:.1f}s).")
+                        result_download_button("Download Searchable PDF", handle)
                     except Exception as e: st.error(f"OCR Error: {e}")
+                    finally: result_store.cleanup(src_path, out_path)
 
 # ==============================================================================
 # CATEGORY 4: EDIT & SECURITY
@@ -760,13 +923,7 @@ elif category == "Edit & Security":
         # Determine Page Size for Sliders
         max_w, max_h = 612, 792 # Defaults (Letter)
         if file:
-            try:
-                # Quick peek for dimensions
-                r_temp = PdfReader(file)
-                p_temp = r_temp.pages[0]
-                max_w = int(float(p_temp.mediabox.width))
-                max_h = int(float(p_temp.mediabox.height))
-                file.seek(0)
+            try: max_w, max_h = [int(v) for v in preview_base(file)['size']]
             except: pass
 
         if "Single" in wm_style and wm_pos == "Custom (Manual X/Y)":
@@ -774,61 +931,17 @@ elif category == "Edit & Security":
             with c_cust1: custom_x = st.slider("X Coordinate", 0, max_w, int(max_w/2))
             with c_cust2: custom_y = st.slider("Y Coordinate", 0, max_h, int(max_h/2))
 
+        hex_color = font_color.lstrip('#'); rgb = tuple(int(hex_color[i:i+2], 16)/255.0 for i in (0, 2, 4))
+        wm_stamp = {'kind': 'watermark', 'text': wm_text, 'font': font_face, 'size': font_size, 'rgb': rgb, 'opacity': opacity, 'rotation': rotation, 'tiled': "Tiled" in wm_style,
+                    'gap_x': gap_x if "Tiled" in wm_style else 0, 'gap_y': gap_y if "Tiled" in wm_style else 0, 'position': wm_pos if "Single" in wm_style else None, 'xy': (custom_x, custom_y)}
         if file:
             try:
                 st.markdown("### Live Preview")
-                reader = PdfReader(file); page_1 = reader.pages[0]; pg_w = float(page_1.mediabox.width); pg_h = float(page_1.mediabox.height)
-                packet = io.BytesIO(); c = canvas.Canvas(packet, pagesize=(pg_w, pg_h))
-                hex_color = font_color.lstrip('#'); rgb = tuple(int(hex_color[i:i+2], 16)/255.0 for i in (0, 2, 4))
-                c.setFont(font_face, font_size); c.setFillColorRGB(*rgb, alpha=opacity); c.saveState()
-                if "Tiled" in wm_style:
-                    c.rotate(rotation); actual_gap_x = gap_x + (len(wm_text) * 2); actual_gap_y = gap_y
-                    for x in range(-int(pg_w*2), int(pg_w*2), actual_gap_x):
-                        for y in range(-int(pg_h*2), int(pg_h*2), actual_gap_y): c.drawString(x, y, wm_text)
-                else:
-                    x, y = 0, 0; margin = 50
-                    if wm_pos == "Custom (Manual X/Y)": x, y = custom_x, custom_y
-                    elif "Center" in wm_pos: x = pg_w/2
-                    elif "Left" in wm_pos: x = margin
-                    elif "Right" in wm_pos: x = pg_w - margin
-                    
-                    if wm_pos != "Custom (Manual X/Y)":
-                        if "Center" in wm_pos and "Top" not in wm_pos and "Bottom" not in wm_pos: y = pg_h/2
-                        elif "Top" in wm_pos: y = pg_h - margin
-                        elif "Bottom" in wm_pos: y = margin
-                    
-                    c.translate(x, y); c.rotate(rotation); c.drawCentredString(0, 0, wm_text)
-                c.restoreState(); c.save(); packet.seek(0)
-                wm_page = PdfReader(packet).pages[0]; first_page = page_1; first_page.merge_page(wm_page)
-                writer = PdfWriter(); writer.add_page(first_page); temp_out = io.BytesIO(); writer.write(temp_out)
-                thumb = get_page_thumbnail(temp_out.getvalue(), poppler_path, width=800)
-                if thumb: st.image(thumb, width=500)
-                file.seek(0)
+                base = preview_base(file)
+                if base['image']: st.image(preview_stamp(base['image'], base['size'], wm_stamp, stamp_text(wm_stamp)), width=500)
             except Exception as e: st.error(f"Preview Error: {e}")
             if st.button("Apply to All Pages & Download", type="primary"):
-                try:
-                    reader = PdfReader(file); writer = PdfWriter(); hex_color = font_color.lstrip('#'); rgb = tuple(int(hex_color[i:i+2], 16)/255.0 for i in (0, 2, 4))
-                    for page in reader.pages:
-                        pg_w = float(page.mediabox.width); pg_h = float(page.mediabox.height); packet = io.BytesIO(); c = canvas.Canvas(packet, pagesize=(pg_w, pg_h))
-                        c.setFont(font_face, font_size); c.setFillColorRGB(*rgb, alpha=opacity); c.saveState()
-                        if "Tiled" in wm_style:
-                            c.rotate(rotation); actual_gap_x = gap_x + (len(wm_text) * 2); actual_gap_y = gap_y
-                            for x in range(-int(pg_w*2), int(pg_w*2), actual_gap_x):
-                                for y in range(-int(pg_h*2), int(pg_h*2), actual_gap_y): c.drawString(x, y, wm_text)
-                        else:
-                            x, y = 0, 0; margin = 50
-                            if wm_pos == "Custom (Manual X/Y)": x, y = custom_x, custom_y
-                            elif "Center" in wm_pos: x = pg_w/2
-                            elif "Left" in wm_pos: x = margin
-                            elif "Right" in wm_pos: x = pg_w - margin
-                            if wm_pos != "Custom (Manual X/Y)":
-                                if "Center" in wm_pos and "Top" not in wm_pos and "Bottom" not in wm_pos: y = pg_h/2
-                                elif "Top" in wm_pos: y = pg_h - margin
-                                elif "Bottom" in wm_pos: y = margin
-                            c.translate(x, y); c.rotate(rotation); c.drawCentredString(0, 0, wm_text)
-                        c.restoreState(); c.save(); packet.seek(0)
-                        wm_layer = PdfReader(packet).pages[0]; page.merge_page(wm_layer); writer.add_page(page)
-                    out = io.BytesIO(); writer.write(out); st.download_button("Download PDF", out.getvalue(), "watermarked.pdf", "application/pdf")
+                try: result_download_button("Download PDF", stamp_upload(file, wm_stamp, "watermarked.pdf"))
                 except Exception as e: st.error(f"Error: {e}")
 
     elif tool == "Add Page Numbers":
@@ -843,41 +956,16 @@ elif category == "Edit & Security":
         with c5: font_color = st.color_picker("Color", "#000000")
         with c6: font_face = font_selector_component("pnum")
 
+        hex_color = font_color.lstrip('#'); rgb = tuple(int(hex_color[i:i+2], 16)/255.0 for i in (0, 2, 4))
+        pnum_stamp = {'kind': 'text', 'text': style_fmt.replace("1", "{page}").replace("N", "{total}"), 'font': font_face, 'size': font_size, 'rgb': rgb, 'opacity': opacity, 'position': position, 'margin': 20}
         if file:
             try:
                 st.markdown("### Live Preview (Page 1)")
-                packet = io.BytesIO(); reader = PdfReader(file); first_page = reader.pages[0]; pg_width = float(first_page.mediabox.width); pg_height = float(first_page.mediabox.height)
-                c = canvas.Canvas(packet, pagesize=(pg_width, pg_height)); hex_color = font_color.lstrip('#'); rgb = tuple(int(hex_color[i:i+2], 16)/255.0 for i in (0, 2, 4))
-                c.setFillColorRGB(*rgb, alpha=opacity); c.setFont(font_face, font_size)
-                text_str = style_fmt.replace("1", "1").replace("N", "5"); margin = 20
-                if "Bottom" in position: y = margin
-                else: y = pg_height - margin
-                if "Left" in position: x = margin; draw_func = c.drawString
-                elif "Right" in position: x = pg_width - margin; draw_func = c.drawRightString
-                else: x = pg_width / 2; draw_func = c.drawCentredString
-                draw_func(x, y, text_str); c.save(); packet.seek(0)
-                num_page = PdfReader(packet).pages[0]; first_page.merge_page(num_page)
-                writer = PdfWriter(); writer.add_page(first_page); temp = io.BytesIO(); writer.write(temp)
-                thumb = get_page_thumbnail(temp.getvalue(), poppler_path, width=800)
-                if thumb: st.image(thumb, width=400)
-                file.seek(0)
+                base = preview_base(file)
+                if base['image']: st.image(preview_stamp(base['image'], base['size'], pnum_stamp, stamp_text(pnum_stamp, 1, base['pages'])), width=400)
             except Exception as e: st.error(f"Preview Error: {e}")
             if st.button("Apply & Download", type="primary"):
-                try:
-                    reader = PdfReader(file); writer = PdfWriter(); total_pages = len(reader.pages)
-                    for i, page in enumerate(reader.pages):
-                        packet = io.BytesIO(); pg_width = float(page.mediabox.width); pg_height = float(page.mediabox.height); c = canvas.Canvas(packet, pagesize=(pg_width, pg_height))
-                        hex_color = font_color.lstrip('#'); rgb = tuple(int(hex_color[i:i+2], 16)/255.0 for i in (0, 2, 4))
-                        c.setFillColorRGB(*rgb, alpha=opacity); c.setFont(font_face, font_size)
-                        p_num = i + 1; text_str = style_fmt.replace("1", str(p_num)).replace("N", str(total_pages)); margin = 20
-                        if "Bottom" in position: y = margin
-                        else: y = pg_height - margin
-                        if "Left" in position: x = margin; draw_func = c.drawString
-                        elif "Right" in position: x = pg_width - margin; draw_func = c.drawRightString
-                        else: x = pg_width / 2; draw_func = c.drawCentredString
-                        draw_func(x, y, text_str); c.save(); packet.seek(0)
-                        num_layer = PdfReader(packet).pages[0]; page.merge_page(num_layer); writer.add_page(page)
-                    out = io.BytesIO(); writer.write(out); st.download_button("Download PDF", out.getvalue(), "numbered.pdf", "application/pdf")
+                try: result_download_button("Download PDF", stamp_upload(file, pnum_stamp, "numbered.pdf"))
                 except Exception as e: st.error(f"Error: {e}")
 
     elif tool == "Header & Footer":
@@ -892,47 +980,23 @@ elif category == "Edit & Security":
         with c5: font_color = st.color_picker("Color", "#000000")
         with c6: font_face = font_selector_component("hf")
 
+        hex_color = font_color.lstrip('#'); rgb = tuple(int(hex_color[i:i+2], 16)/255.0 for i in (0, 2, 4))
+        hf_stamp = {'kind': 'text', 'text': user_text, 'font': font_face, 'size': font_size, 'rgb': rgb, 'opacity': opacity, 'position': position, 'margin': 20}
         if file:
             try:
                 st.markdown("### Live Preview (Page 1)")
-                packet = io.BytesIO(); reader = PdfReader(file); first_page = reader.pages[0]; pg_width = float(first_page.mediabox.width); pg_height = float(first_page.mediabox.height)
-                c = canvas.Canvas(packet, pagesize=(pg_width, pg_height)); hex_color = font_color.lstrip('#'); rgb = tuple(int(hex_color[i:i+2], 16)/255.0 for i in (0, 2, 4))
-                c.setFillColorRGB(*rgb, alpha=opacity); c.setFont(font_face, font_size)
-                margin = 20
-                if "Bottom" in position: y = margin
-                else: y = pg_height - margin
-                if "Left" in position: x = margin; draw_func = c.drawString
-                elif "Right" in position: x = pg_width - margin; draw_func = c.drawRightString
-                else: x = pg_width / 2; draw_func = c.drawCentredString
-                draw_func(x, y, user_text); c.save(); packet.seek(0)
-                hf_page = PdfReader(packet).pages[0]; first_page.merge_page(hf_page)
-                writer = PdfWriter(); writer.add_page(first_page); temp = io.BytesIO(); writer.write(temp)
-                thumb = get_page_thumbnail(temp.getvalue(), poppler_path, width=800)
-                if thumb: st.image(thumb, width=400)
-                file.seek(0)
+                base = preview_base(file)
+                if base['image']: st.image(preview_stamp(base['image'], base['size'], hf_stamp, stamp_text(hf_stamp)), width=400)
             except Exception as e: st.error(f"Preview Error: {e}")
             if st.button("Apply & Download", type="primary"):
-                try:
-                    reader = PdfReader(file); writer = PdfWriter()
-                    for i, page in enumerate(reader.pages):
-                        packet = io.BytesIO(); pg_width = float(page.mediabox.width); pg_height = float(page.mediabox.height); c = canvas.Canvas(packet, pagesize=(pg_width, pg_height))
-                        hex_color = font_color.lstrip('#'); rgb = tuple(int(hex_color[i:i+2], 16)/255.0 for i in (0, 2, 4))
-                        c.setFillColorRGB(*rgb, alpha=opacity); c.setFont(font_face, font_size)
-                        margin = 20
-                        if "Bottom" in position: y = margin
-                        else: y = pg_height - margin
-                        if "Left" in position: x = margin; draw_func = c.drawString
-                        elif "Right" in position: x = pg_width - margin; draw_func = c.drawRightString
-                        else: x = pg_width / 2; draw_func = c.drawCentredString
-                        draw_func(x, y, user_text); c.save(); packet.seek(0)
-                        hf_layer = PdfReader(packet).pages[0]; page.merge_page(hf_layer); writer.add_page(page)
-                    out = io.BytesIO(); writer.write(out); st.download_button("Download PDF", out.getvalue(), "document_with_header.pdf", "application/pdf")
+                try: result_download_button("Download PDF", stamp_upload(file, hf_stamp, "document_with_header.pdf"))
                 except Exception as e: st.error(f"Error: {e}")
 
     elif tool == "Rotate PDF":
         st.header("🔄 Rotate PDF")
         mode = st.radio("Rotate Mode", ["Rotate All Pages", "Rotate Individual Pages"])
         file = st.file_uploader("Upload PDF", type="pdf")
+        incremental = st.checkbox("Incremental update (append changes to the original file)", key="rot_incremental")
         if file:
             if mode == "Rotate All Pages":
                 if 'global_rot_angle' not in st.session_state: st.session_state['global_rot_angle'] = 0
@@ -944,52 +1008,24 @@ elif category == "Edit & Security":
                 with col3: st.write(f"**Current Rotation:** {st.session_state['global_rot_angle']}°")
                 rot = st.session_state['global_rot_angle']
                 try:
-                    reader = PdfReader(file); p1 = reader.pages[0]; p1.rotate(rot)
-                    writer = PdfWriter(); writer.add_page(p1); temp = io.BytesIO(); writer.write(temp)
                     st.write("### Preview (Page 1)")
-                    thumb = get_page_thumbnail(temp.getvalue(), poppler_path, width=400)
-                    if thumb: st.image(thumb, width=300)
-                    file.seek(0)
+                    base = preview_base(file)
+                    if base['image']: st.image(base['image'].rotate(-rot, expand=True) if rot else base['image'], width=300)
                 except: st.error("Preview failed")
                 if st.button("Rotate All & Download", type="primary"):
-                    reader = PdfReader(file); writer = PdfWriter()
-                    for page in reader.pages: page.rotate(rot); writer.add_page(page)
-                    out = io.BytesIO(); writer.write(out)
-                    st.download_button("Download Rotated PDF", out.getvalue(), "rotated_all.pdf", "application/pdf")
+                    handle = page_box_upload(file, "rotated_all.pdf", incremental, rotations={i: rot for i in range(preview_base(file)['pages'])})
+                    result_download_button("Download Rotated PDF", handle)
             else:
                 file_id = f"{file.name}_{file.size}_rot"
                 if 'current_rot_file' not in st.session_state or st.session_state['current_rot_file'] != file_id:
-                    st.session_state['current_rot_file'] = file_id; st.session_state['rotate_states'] = {} 
-                reader = PdfReader(file)
-                total_pages = len(reader.pages)
-                st.write(f"Total Pages: {total_pages}")
-                cols = st.columns(4)
-                for i in range(total_pages):
-                    current_angle = st.session_state['rotate_states'].get(i, 0)
-                    with cols[i % 4]:
-                        with st.container():
-                            st.markdown(f"<div class='page-card'>", unsafe_allow_html=True)
-                            st.caption(f"Page {i+1}")
-                            writer = PdfWriter(); writer.add_page(reader.pages[i]); p_bytes = io.BytesIO(); writer.write(p_bytes)
-                            thumb = get_page_thumbnail(p_bytes.getvalue(), poppler_path)
-                            if thumb:
-                                rotated_thumb = thumb.rotate(-current_angle, expand=True)
-                                st.image(rotated_thumb, use_container_width=True)
-                            else: st.info("No Preview")
-                            c1, c2 = st.columns(2)
-                            if c1.button("⟲", key=f"ccw_{i}"): st.session_state['rotate_states'][i] = (current_angle - 90) % 360; st.rerun()
-                            if c2.button("⟳", key=f"cw_{i}"): st.session_state['rotate_states'][i] = (current_angle + 90) % 360; st.rerun()
-                            st.caption(f"Rot: {st.session_state['rotate_states'].get(i, 0)}°")
-                            st.markdown("</div>", unsafe_allow_html=True)
+                    st.session_state['current_rot_file'] = file_id
+                    st.session_state['rotate_queue'] = page_store.records(page_store.add(file.getvalue()), source=file.name)
+                st.write(f"Total Pages: {len(st.session_state['rotate_queue'])}")
+                page_grid('rotate_queue', "rot", allow_move=False, show_rotation=True)
                 st.markdown("---")
                 if st.button("Apply Rotations & Download", type="primary"):
-                    final_writer = PdfWriter(); file.seek(0); r = PdfReader(file)
-                    for i, page in enumerate(r.pages):
-                        angle = st.session_state['rotate_states'].get(i, 0)
-                        if angle != 0: page.rotate(angle)
-                        final_writer.add_page(page)
-                    out = io.BytesIO(); final_writer.write(out)
-                    st.download_button("Download Result", out.getvalue(), "individual_rotated.pdf", "application/pdf")
+                    handle = page_box_upload(file, "individual_rotated.pdf", incremental, rotations={i: item.get('rotation', 0) for i, item in enumerate(st.session_state['rotate_queue'])})
+                    result_download_button("Download Result", handle)
 
     elif tool == "Crop PDF":
         st.header("✂️ Crop PDF")
@@ -1001,23 +1037,16 @@ elif category == "Edit & Security":
         c3, c4 = st.columns(2)
         with c3: top = st.slider("Top Margin", 0, 200, 0)
         with c4: bottom = st.slider("Bottom Margin", 0, 200, 0)
+        incremental = st.checkbox("Incremental update (append changes to the original file)", key="crop_incremental")
         if file:
             try:
-                reader = PdfReader(file); page = reader.pages[0]; orig_ur = page.mediabox.upper_right; orig_w = float(orig_ur[0]); orig_h = float(orig_ur[1])
-                page.cropbox.lower_left = (left, bottom); page.cropbox.upper_right = (orig_w - right, orig_h - top)
-                writer = PdfWriter(); writer.add_page(page); temp = io.BytesIO(); writer.write(temp)
                 st.markdown("### Cropped Preview (Page 1)")
-                thumb = get_page_thumbnail(temp.getvalue(), poppler_path, width=400)
-                if thumb: st.image(thumb, width=400)
-                file.seek(0)
+                base = preview_base(file)
+                if base['image']: st.image(preview_crop(base['image'], base['cropbox'], base['mediabox'], base['rotation'], left, bottom, right, top), width=400)
             except Exception as e: st.error(f"Preview Error: {e}")
             if st.button("Crop & Download", type="primary"):
-                reader = PdfReader(file); writer = PdfWriter()
-                for page in reader.pages:
-                    orig_ur = page.mediabox.upper_right; w, h = float(orig_ur[0]), float(orig_ur[1])
-                    page.cropbox.lower_left = (left, bottom); page.cropbox.upper_right = (w - right, h - top); writer.add_page(page)
-                out = io.BytesIO(); writer.write(out)
-                st.download_button("Download Cropped PDF", out.getvalue(), "cropped.pdf", "application/pdf")
+                handle = page_box_upload(file, "cropped.pdf", incremental, crop=(left, bottom, right, top))
+                result_download_button("Download Cropped PDF", handle)
 
     elif tool == "Sign PDF":
         st.header("✍️ Sign PDF")
@@ -1027,31 +1056,10 @@ elif category == "Edit & Security":
             file_hash = f"{file.name}_{file.size}_sign"
             if 'visual_sign_file_hash' not in st.session_state or st.session_state['visual_sign_file_hash'] != file_hash:
                 st.session_state['visual_sign_file_hash'] = file_hash; st.session_state['visual_sign_queue'] = []
-                file.seek(0); reader = PdfReader(file)
-                for i, page in enumerate(reader.pages):
-                    writer = PdfWriter(); writer.add_page(page); p_bytes = io.BytesIO(); writer.write(p_bytes)
-                    st.session_state['visual_sign_queue'].append({
-                        'id': str(uuid.uuid4()), 'page_num': i + 1, 'bytes': p_bytes.getvalue(), 'rotation': 0
-                    })
+                doc_id = page_store.add(file.getvalue())
+                st.session_state['visual_sign_queue'] = page_store.records(doc_id, source=file.name)
             with st.expander("👁️ Organize Pages (Rotate / Reorder)", expanded=False):
-                if st.session_state['visual_sign_queue']:
-                    total_pg = len(st.session_state['visual_sign_queue']); cols = st.columns(4)
-                    for i, item in enumerate(st.session_state['visual_sign_queue']):
-                        with cols[i % 4]:
-                            with st.container():
-                                st.markdown(f"<div class='page-card'>", unsafe_allow_html=True)
-                                st.caption(f"Pg {i+1}")
-                                thumb = get_page_thumbnail(item['bytes'], poppler_path)
-                                rot = item.get('rotation', 0)
-                                if thumb and rot != 0: thumb = thumb.rotate(-rot, expand=True)
-                                if thumb: st.image(thumb, use_container_width=True)
-                                c_rot1, c_rot2 = st.columns(2)
-                                if c_rot1.button("⟲", key=f"ccw_sg_{item['id']}"): st.session_state['visual_sign_queue'][i]['rotation'] = (rot - 90) % 360; st.rerun()
-                                if c_rot2.button("⟳", key=f"cw_sg_{item['id']}"): st.session_state['visual_sign_queue'][i]['rotation'] = (rot + 90) % 360; st.rerun()
-                                c1, c3 = st.columns(2)
-                                if c1.button("⬅️", key=f"L_sg_{item['id']}") and i > 0: st.session_state['visual_sign_queue'][i], st.session_state['visual_sign_queue'][i-1] = st.session_state['visual_sign_queue'][i-1], st.session_state['visual_sign_queue'][i]; st.rerun()
-                                if c3.button("➡️", key=f"R_sg_{item['id']}") and i < total_pg - 1: st.session_state['visual_sign_queue'][i], st.session_state['visual_sign_queue'][i+1] = st.session_state['visual_sign_queue'][i+1], st.session_state['visual_sign_queue'][i]; st.rerun()
-                                st.markdown("</div>", unsafe_allow_html=True)
+                if st.session_state['visual_sign_queue']: page_grid('visual_sign_queue', "sg", caption=lambda i, item: f"Pg {i+1}")
             st.markdown("---")
         
         sig_source = st.radio("Signature Source", ["Draw New", "Type Text", "Upload Image", "Use Default"], horizontal=True)
@@ -1122,18 +1130,7 @@ elif category == "Edit & Security":
                 if preview_page_idx is not None:
                     try:
                         item = st.session_state['visual_sign_queue'][preview_page_idx]
-                        p_reader = PdfReader(io.BytesIO(item['bytes'])); page = p_reader.pages[0]
-                        rot = item.get('rotation', 0)
-                        if rot != 0: page.rotate(rot)
-                        temp_writer = PdfWriter(); temp_writer.add_page(page); temp_pdf_bytes_io = io.BytesIO(); temp_writer.write(temp_pdf_bytes_io); temp_pdf_bytes = temp_pdf_bytes_io.getvalue()
-                        temp_reader = PdfReader(io.BytesIO(temp_pdf_bytes)); preview_page = temp_reader.pages[0]; pg_w = float(preview_page.mediabox.width); pg_h = float(preview_page.mediabox.height)
-                        packet = io.BytesIO(); c = canvas.Canvas(packet, pagesize=(pg_w, pg_h))
-                        img_byte_arr = io.BytesIO(); final_sig_image.save(img_byte_arr, format='PNG'); img_byte_arr.seek(0); sig_img = ImageReader(img_byte_arr)
-                        c.drawImage(sig_img, x_pos, y_pos, width=width, height=height, mask='auto')
-                        c.save(); packet.seek(0)
-                        sig_layer = PdfReader(packet).pages[0]; preview_page.merge_page(sig_layer)
-                        final_prev_writer = PdfWriter(); final_prev_writer.add_page(preview_page); prev_bytes = io.BytesIO(); final_prev_writer.write(prev_bytes)
-                        thumb = get_page_thumbnail(prev_bytes.getvalue(), poppler_path, width=preview_zoom)
+                        thumb = get_page_thumbnail(page_store.sign([item], final_sig_image, (x_pos, y_pos, width, height)), poppler_path, width=preview_zoom)
                         if thumb: st.image(thumb, caption=f"Live Preview (Page {preview_page_idx+1})", width=preview_zoom)
                     except Exception as e: st.error(f"Preview Error: {e}")
                 else: st.info("Please select pages to view preview.")
@@ -1143,24 +1140,10 @@ elif category == "Edit & Security":
                     else:
                         target_indices = parse_order_string(p_input, total_pages)
                         if not target_indices: st.error("Invalid page selection."); st.stop()
-                    writer = PdfWriter()
-                    img_byte_arr = io.BytesIO(); final_sig_image.save(img_byte_arr, format='PNG'); img_byte_arr.seek(0)
-                    for i, item in enumerate(st.session_state['visual_sign_queue']):
-                        p_reader = PdfReader(io.BytesIO(item['bytes'])); page = p_reader.pages[0]
-                        rot = item.get('rotation', 0)
-                        if rot != 0: page.rotate(rot)
-                        if i in target_indices:
-                            t_writer = PdfWriter(); t_writer.add_page(page); t_io = io.BytesIO(); t_writer.write(t_io)
-                            t_reader = PdfReader(io.BytesIO(t_io.getvalue())); target_page = t_reader.pages[0]
-                            pg_w = float(target_page.mediabox.width); pg_h = float(target_page.mediabox.height)
-                            packet = io.BytesIO(); c = canvas.Canvas(packet, pagesize=(pg_w, pg_h))
-                            img_byte_arr.seek(0); sig_img_rl = ImageReader(img_byte_arr)
-                            c.drawImage(sig_img_rl, x_pos, y_pos, width=width, height=height, mask='auto')
-                            c.save(); packet.seek(0)
-                            sig_layer = PdfReader(packet).pages[0]; target_page.merge_page(sig_layer); writer.add_page(target_page)
-                        else: writer.add_page(page)
-                    out = io.BytesIO(); writer.write(out)
-                    st.download_button("Download Signed PDF", out.getvalue(), "signed_document.pdf", "application/pdf")
+                    out_path = result_store.new_path(".pdf")
+                    page_store.sign(st.session_state['visual_sign_queue'], final_sig_image, (x_pos, y_pos, width, height), pages=set(target_indices), output=out_path)
+                    handle = result_store.register(out_path, "signed_document.pdf", "application/pdf")
+                    result_download_button("Download Signed PDF", handle)
                 except Exception as e: st.error(f"Error signing document: {e}")
 
     elif tool == "Lock PDF":
@@ -1187,12 +1170,14 @@ elif category == "Edit & Security":
                     locked_bytes = io.BytesIO(file.read())
                     try:
                         with pikepdf.open(locked_bytes, password=user_pw) as pdf:
-                            output_stream = io.BytesIO(); pdf.save(output_stream); st.session_state['unlocked_file_data'] = output_stream.getvalue()
+                            unlocked_path = result_store.new_path(".pdf"); pdf.save(unlocked_path)
+                        result_store.discard(st.session_state['unlocked_file_data'])
+                        st.session_state['unlocked_file_data'] = result_store.register(unlocked_path, "unlocked.pdf", "application/pdf")
                         st.success("Unlocked successfully!")
                     except pikepdf.PasswordError: st.error("Incorrect password.")
                     except Exception as e: st.error(f"Error: {e}")
                 except Exception as e: st.error(f"System Error: {e}")
-            if st.session_state['unlocked_file_data']: st.download_button(label="Download Unlocked PDF", data=st.session_state['unlocked_file_data'], file_name="unlocked.pdf", mime="application/pdf")
+            if result_store.exists(st.session_state['unlocked_file_data']): result_download_button("Download Unlocked PDF", st.session_state['unlocked_file_data'])
         else: 
             mode = st.radio("Recovery Mode", ["Dictionary Attack (Fast)", "Brute Force (Comprehensive)"])
             use_custom_list = st.checkbox("Use Custom Wordlist (.txt)")